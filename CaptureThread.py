@@ -0,0 +1,83 @@
+# Reads the camera on its own thread, so the render loop never waits for camera I/O, and always gets the newest frame
+# Frames are read into a small ring of buffers. Frames nobody read before a newer one arrived are dropped and counted.
+# The buffer being read into is never the newest frame or the one last handed out, so a frame is not changed while used
+
+import threading
+import time
+
+class CaptureThread:
+    def __init__(self, capture, buffer_count = 3, max_failures = 100, retry_interval = 0.01):
+        self.capture = capture
+        # Many cameras fail to read the first frames, or now and then. Only give up after max_failures in a row.
+        self.max_failures = max_failures
+        self.retry_interval = retry_interval
+        self.failures = 0
+        # Three buffers are the least that works: the newest frame, the one handed out, and one to read into
+        self.buffers = [None] * max(buffer_count, 3)
+        self.condition = threading.Condition()
+        self.newest = None
+        self.handed_out = None
+        # Counts of frames read from the camera, handed to the render loop, and overwritten before they were handed out
+        self.captured = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.frame_id = 0
+        self.last_read_id = 0
+        self.ended = False
+        self.stopping = False
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.thread.start()
+
+    def is_opened(self):
+        return not self.ended and not self.stopping
+
+    def read(self, timeout = 1.0):
+        # Returns the newest frame not returned before, waiting for it if needed, like cv2.VideoCapture.read()
+        # The frame may be overwritten once read is called again, copy it to keep it longer
+        with self.condition:
+            self.condition.wait_for(lambda: self.frame_id != self.last_read_id or not self.is_opened(), timeout)
+            if self.frame_id == self.last_read_id:
+                return False, None
+            self.last_read_id = self.frame_id
+            self.handed_out = self.newest
+            self.delivered += 1
+            return True, self.buffers[self.newest]
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        self.thread.join()
+        self.capture.release()
+
+    def free_buffer(self):
+        for index in range(len(self.buffers)):
+            if index != self.newest and index != self.handed_out:
+                return index
+
+    def work(self):
+        while not self.stopping:
+            if not self.capture.isOpened():
+                break
+            with self.condition:
+                index = self.free_buffer()
+            # Reads into the buffer when it has the right size already, the first frames allocate it
+            ready, frame = self.capture.read(self.buffers[index])
+            if not ready:
+                self.failures += 1
+                if self.failures >= self.max_failures:
+                    break
+                time.sleep(self.retry_interval)
+                continue
+            self.failures = 0
+            with self.condition:
+                self.buffers[index] = frame
+                if self.frame_id != self.last_read_id:
+                    self.dropped += 1
+                self.newest = index
+                self.frame_id += 1
+                self.captured += 1
+                self.condition.notify_all()
+        with self.condition:
+            self.ended = True
+            self.condition.notify_all()
@@ -0,0 +1,103 @@
+# Wraps the code into lines that fit the screen, and finds the x position of every character
+# Live coding only appends or deletes at the end, so only the last lines are wrapped again when the code changes
+# Widths come from a table of glyph advances, since the width of Hershey text is a base plus the advance of each glyph
+
+import cv2
+import os
+
+class GlyphWidths:
+    def __init__(self, font_face = cv2.FONT_HERSHEY_PLAIN, font_scale = 2, font_line_thickness = 2):
+        self.font_face = font_face
+        self.font_scale = font_scale
+        self.font_line_thickness = font_line_thickness
+        self.advances = {}
+        self.empty_width = self.measure('')
+        # What the width of any text adds to the advances of its glyphs, the same for every glyph
+        self.base = self.measure('+') - self.advance('+')
+
+    def measure(self, text):
+        ((txt_w, _), _) = cv2.getTextSize(text, self.font_face, self.font_scale, self.font_line_thickness)
+        return txt_w
+
+    def advance(self, char):
+        # Measured once per glyph: the width of a glyph twice minus the width of it once
+        advance = self.advances.get(char)
+        if advance is None:
+            advance = self.measure(char + char) - self.measure(char)
+            self.advances[char] = advance
+        return advance
+
+    def width(self, text):
+        # Same as cv2.getTextSize(text, ...)[0][0]
+        if len(text) == 0:
+            return self.empty_width
+        advance = sum(self.advance(char) for char in text)
+        return self.base + advance
+
+    def offsets(self, text):
+        # x offset of each character, where the text starts at 0
+        # Subtract 2, beacuse the measurement of an empty string apparently is 2
+        x = [0]
+        text_width = self.base - 2
+        for char in text[:-1]:
+            text_width += self.advance(char)
+            x.append(text_width)
+        return x[:len(text)]
+
+class CodeLayout:
+    def __init__(self, min_chars_per_line, glyphs = None):
+        self.min_chars_per_line = min_chars_per_line
+        self.glyphs = GlyphWidths() if glyphs is None else glyphs
+        self.max_width = None
+        self.text = ''
+        # Index into text of the first character of each line
+        self.starts = []
+        self.lines = []
+        self.line_x = []
+        self.result = ([], [])
+
+    def wrap(self, code, max_width):
+        # Returns the lines of code, and the x offset of every character on each line
+        # The lists returned are never changed afterwards, they are replaced when the code changes
+        text = code.strip()
+        if text == self.text and max_width == self.max_width:
+            return self.result
+        if max_width != self.max_width:
+            self.max_width = max_width
+            self.starts, self.lines, self.line_x = [], [], []
+
+        # A line is the same as long as its characters, and the one after it that didn't fit, are the same, and there
+        # is enough code left to fill a line. Wrap again from the first line that doesn't pass that.
+        unchanged = len(os.path.commonprefix([text, self.text]))
+        keep = 0
+        while keep + 1 < len(self.starts) and self.starts[keep + 1] + self.min_chars_per_line + 1 <= unchanged:
+            keep += 1
+        position = self.starts[keep] if keep < len(self.starts) else 0
+        del self.starts[keep:]
+        del self.lines[keep:]
+        del self.line_x[keep:]
+        self.text = text
+
+        # Fill each line with at least min_chars_per_line characters, and more as long as they fit
+        while position < len(text):
+            left = len(text) - position
+            if left > self.min_chars_per_line:
+                char_count = self.min_chars_per_line
+                line_width = self.glyphs.width(text[position:position + char_count])
+                while line_width < max_width and char_count < left:
+                    char_count += 1
+                    line_width += self.glyphs.advance(text[position + char_count - 1])
+                if line_width > max_width:
+                    char_count -= 1
+            else:
+                char_count = left
+            self.add_line(position, text[position:position + char_count].strip())
+            position += char_count
+
+        self.result = (list(self.lines), list(self.line_x))
+        return self.result
+
+    def add_line(self, start, line):
+        self.starts.append(start)
+        self.lines.append(line)
+        self.line_x.append(self.glyphs.offsets(line))
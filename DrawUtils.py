@@ -1,8 +1,95 @@
+from CodeLayout import GlyphWidths
+from collections import OrderedDict, namedtuple
 import cv2
 import numpy as np
 
+def draw_alpha_box(img, x, y, h, w, value, opacity):
+    # Blend a box of gray value over the image, in place and in a single pass, without allocating a box to blend with
+    # Computes pixel * (1 - opacity) + value * opacity + 1, rounded the same as cv2.addWeighted
+    sub_img = img[y:y+h, x:x+w]
+    if sub_img.size > 0:
+        cv2.convertScaleAbs(sub_img, dst=sub_img, alpha=1 - opacity, beta=value * opacity + 1.0)
+
+# Text drawn once with putText, stored premultiplied by its alpha, and the inverse alpha to blend it with
+# dx, dy is the top left corner relative to the putText origin, width is what cv2.getTextSize measures
+Sprite = namedtuple('Sprite', ['layer', 'inverse_alpha', 'dx', 'dy', 'width'])
+
+class GlyphAtlas:
+    # Draws text by blending pre-rendered sprites into the image, instead of stroking the Hershey font every frame
+    def __init__(self):
+        self.sprites = {}
+        self.glyph_widths = {}
+
+    def prepare(self, texts, font_face, font_scale, color, thickness):
+        # Render the sprites up front, so the first frame that needs them isn't slower
+        for text in texts:
+            self.sprite(text, font_face, font_scale, color, thickness)
+
+    def sprite(self, text, font_face, font_scale, color, thickness):
+        key = (text, font_face, font_scale, tuple(color), thickness)
+        sprite = self.sprites.get(key)
+        if sprite is None:
+            sprite = self.render(text, font_face, font_scale, color, thickness)
+            self.sprites[key] = sprite
+        return sprite
+
+    def render(self, text, font_face, font_scale, color, thickness):
+        (width, height), baseline = cv2.getTextSize(text, font_face, font_scale, thickness)
+        # Thick strokes stick out of the measured box
+        pad = thickness + 2
+        canvas = np.zeros((height + baseline + 2 * pad, width + 2 * pad), np.uint8)
+        cv2.putText(canvas, text, (pad, pad + height), font_face, font_scale, 255, thickness)
+        ys, xs = np.nonzero(canvas)
+        if len(ys) == 0:
+            return Sprite(np.zeros((0, 0, 3), np.uint8), np.zeros((0, 0, 3), np.uint8), 0, 0, width)
+        top, bottom, left, right = ys.min(), ys.max() + 1, xs.min(), xs.max() + 1
+        alpha = cv2.merge([canvas[top:bottom, left:right]] * 3)
+        layer = cv2.multiply(np.full(alpha.shape, color[:3], np.uint8), alpha, scale=1 / 255)
+        return Sprite(layer, 255 - alpha, int(left) - pad, int(top) - pad - height, width)
+
+    def text_width(self, text, font_face, font_scale, thickness, color = (255, 255, 255)):
+        return self.sprite(text, font_face, font_scale, color, thickness).width
+
+    def draw(self, img, text, org, font_face, font_scale, color, thickness):
+        # Same arguments as cv2.putText
+        sprite = self.sprite(text, font_face, font_scale, color, thickness)
+        x, y = org[0] + sprite.dx, org[1] + sprite.dy
+        h, w = sprite.layer.shape[:2]
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + w, img.shape[1]), min(y + h, img.shape[0])
+        if x0 >= x1 or y0 >= y1:
+            return
+        roi = img[y0:y1, x0:x1]
+        # roi * (1 - alpha) + color * alpha
+        cv2.multiply(roi, sprite.inverse_alpha[y0 - y:y1 - y, x0 - x:x1 - x], dst=roi, scale=1 / 255)
+        cv2.add(roi, sprite.layer[y0 - y:y1 - y, x0 - x:x1 - x], dst=roi)
+
+    def draw_glyphs(self, img, text, org, font_face, font_scale, color, thickness):
+        # Same as draw, but with a sprite per character instead of per text, for text like numbers, that has too
+        # many different values to keep a sprite of each. The characters are placed by their advances.
+        key = (font_face, font_scale, thickness)
+        glyphs = self.glyph_widths.get(key)
+        if glyphs is None:
+            glyphs = GlyphWidths(font_face, font_scale, thickness)
+            self.glyph_widths[key] = glyphs
+        x, y = org
+        for char in text:
+            self.draw(img, char, (x, y), font_face, font_scale, color, thickness)
+            x += glyphs.advance(char)
+
+# Shared by everything drawing the HUD
+GLYPH_ATLAS = GlyphAtlas()
+
 class SpeechBubble:
-    def draw(self, image, bubble_x, bubble_y, scale):
+    def __init__(self, text = "Whoops!", scale_step = 4, cache_size = 32):
+        self.text = text
+        # Bubbles are cached per text and per scale rounded to scale_step, the least recently used dropped first
+        self.scale_step = scale_step
+        self.cache_size = cache_size
+        self.sprites = OrderedDict()
+        self.text_sizes = {}
+
+    def draw(self, image, bubble_x, bubble_y, scale, text = None):
         """
         Draws a cartoon-style speech bubble on an image.
 
@@ -11,15 +98,50 @@ class SpeechBubble:
         - bubble_x: The x value of bottom right corner of the bubble.
         - bubble_y: The y value of bottom right corner of the bubble.
         - scale: Some value relative to body size, for scaling the bubble.
+        - text: The text in the bubble, if not the one given when creating it.
         """
+        sprite, mask, anchor_x, anchor_y = self.sprite(self.text if text is None else text, scale)
+        x, y = bubble_x - anchor_x, bubble_y - anchor_y
+        h, w = mask.shape
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + w, image.shape[1]), min(y + h, image.shape[0])
+        if x0 >= x1 or y0 >= y1:
+            return
+        roi = image[y0:y1, x0:x1]
+        cv2.copyTo(sprite[y0 - y:y1 - y, x0 - x:x1 - x], mask[y0 - y:y1 - y, x0 - x:x1 - x], roi)
+
+    def sprite(self, text, scale):
+        # Returns the bubble image, its mask, and where the mouth is in them
+        scale = int(round(scale / self.scale_step)) * self.scale_step
+        key = (text, scale)
+        sprite = self.sprites.get(key)
+        if sprite is not None:
+            self.sprites.move_to_end(key)
+            return sprite
+
+        if text not in self.text_sizes:
+            self.text_sizes[text] = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 1, 2)[0]
+        text_size = self.text_sizes[text]
+        bubble_size = (int(text_size[0] * 1.25), int(text_size[1] * 3))
+        margin = 2
+        anchor_x, anchor_y = bubble_size[0] + margin, bubble_size[1] + max(scale, 0) + margin
+        shape = (anchor_y + margin + 1, anchor_x + margin + 1)
+        image = np.zeros(shape + (3,), np.uint8)
+        self.paint(image, anchor_x, anchor_y, scale, text, text_size, (255, 255, 255), (0, 0, 0))
+        mask = np.zeros(shape, np.uint8)
+        self.paint(mask, anchor_x, anchor_y, scale, text, text_size, 255, 255)
+        sprite = (image, mask, anchor_x, anchor_y)
+
+        self.sprites[key] = sprite
+        if len(self.sprites) > self.cache_size:
+            self.sprites.popitem(last=False)
+        return sprite
+
+    def paint(self, image, bubble_x, bubble_y, scale, text, text_size, bubble_color, text_color):
         # Bubble parameters
-        text = "Whoops!"
-        bubble_color = (255, 255, 255)  # White
-        text_color = (0, 0, 0)  # Black
         font_scale = 1
         thickness = 2
         font = cv2.FONT_HERSHEY_SIMPLEX        
-        text_size = cv2.getTextSize(text, font, font_scale, thickness)[0]
         radius = int(text_size[1] / 2)  # Radius for rounded corners
         bubble_size = (int(text_size[0] * 1.25), int(text_size[1] * 3)) # A tuple (width, height) representing the size of the bubble.
 
@@ -43,8 +165,7 @@ class SpeechBubble:
 
         cv2.fillPoly(image, [tail_points], bubble_color)
 
-        # Calculate text size to center it within the bubble
-        text_size = cv2.getTextSize(text, font, font_scale, thickness)[0]
+        # Center the text within the bubble
         text_x = top_left[0] + (bubble_size[0] - text_size[0]) // 2
         text_y = top_left[1] + (bubble_size[1] + text_size[1]) // 2
 
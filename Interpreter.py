@@ -1,109 +1,628 @@
 # Brainfuck interpreter
 # Does not implement input (,)
 # The input code split over multiple lines with space
-# Each call to step returns the char index + line index of a non-space command + any output
-# When the end of the program is reaced (False, c, l, '') is returned
+# The lines are flattened into a program of commands only, and compiled into a flat instruction array
+# Execution only knows the program counter (pc), an index into the program. A separate layout index maps
+# between pc and screen position, and only that index is refreshed when the code is wrapped differently
+# Each call to step returns the pc of the command executed + any output
+# When the end of the program is reaced (True, True, pc, '') is returned
 
+from array import array
+from bisect import bisect_left, bisect_right
+from CodeLayout import GlyphWidths
+from collections import namedtuple
+from functools import lru_cache
 import cv2
+from DrawUtils import GLYPH_ATLAS, draw_alpha_box
 import numpy as np
+import os
+import sys
+import time
+
+COMMANDS = '+-<>[].'
+
+# The font the code is drawn with
+CODE_GLYPHS = GlyphWidths(cv2.FONT_HERSHEY_PLAIN, 2, 2)
+
+CELL_TEXTS = [str(value) for value in range(256)]
+
+# Color of each cell value in the tape heatmap, zero is black
+HEATMAP_COLORS = cv2.applyColorMap(np.arange(256, dtype=np.uint8).reshape(-1, 1), cv2.COLORMAP_INFERNO).reshape(256, 3)
+
+# How run_frame paces the interpreter
+# watch: the visual pace, one command per frame in loops and every third frame outside them
+# fast: as many commands as fit in frame_budget seconds
+# run: like fast, but pause at every output
+MODES = ('watch', 'fast', 'run')
+
+# Immutable copy of what the screen shows of the interpreter, safe to read from another thread
+InterpreterSnapshot = namedtuple('InterpreterSnapshot', ['pc', 'last_pc', 'cell_pointer', 'cell_offset', 'cells', 'tape_length', 'output', 'finished', 'step_count', 'mode',
+                                                         'stuck_loop', 'step_limit_reached', 'tape_heat'])
+
+# Compiled instructions, stored as (kind, argument, end) where end is the program index after the instruction
+OP_ADD = 0       # Run of + and -, argument is the sum of the run
+OP_MOVE = 1      # Run of > or <, argument is the signed length of the run
+OP_CLEAR = 2     # [-] or [+], argument is the change per iteration
+OP_MULTIPLY = 3  # Balanced loop of +-<> only, argument is (change per iteration, ((offset, factor), ...), min offset, max offset)
+
+# One row per command executed while tracing: the step before it, its pc, the cell pointer before it, the value of
+# that cell after it, and the output character or -1. Saved as .npy, which np.load(path, mmap_mode='r') maps
+TRACE_DTYPE = np.dtype([('step', '<i8'), ('pc', '<i4'), ('pointer', '<i4'), ('value', 'u1'), ('output', '<i2')])
+
+# Checkpoints store the tape as a table of pages. Pages of zeros are None, and pages that are the same as in the
+# checkpoint before are shared with it, so a checkpoint only costs memory for the pages written in between
+PAGE_SIZE = 1024
+ZERO_PAGE = bytes(PAGE_SIZE)
+
+HASH_MASK = (1 << 64) - 1
+
+def tape_pages(tape, previous = ()):
+    # Page table of the tape, a memoryview, sharing pages equal to those in the previous page table
+    pages = []
+    for index, start in enumerate(range(0, len(tape), PAGE_SIZE)):
+        page = tape[start:start + PAGE_SIZE]
+        if page == ZERO_PAGE[:len(page)]:
+            pages.append(None)
+        elif index < len(previous) and previous[index] is not None and page == previous[index]:
+            pages.append(previous[index])
+        else:
+            pages.append(page.tobytes())
+    return tuple(pages)
+
+def checkpoint_bytes(checkpoints):
+    # Memory held by the checkpoints, counting the pages and output lists they share only once
+    # A character of output costs a list item and an output step, 8 bytes each
+    seen = set()
+    total = 0
+    for checkpoint in checkpoints:
+        (_, pages), (_, (output, _)) = checkpoint[4], checkpoint[5]
+        for page in pages:
+            if page is not None and id(page) not in seen:
+                seen.add(id(page))
+                total += len(page)
+        if id(output) not in seen:
+            seen.add(id(output))
+            total += 16 * len(output)
+    return total
+
+def cell_weights(count):
+    # cell_weight of the cells 0 to count - 1, computed together in uint64, which wraps around like HASH_MASK
+    with np.errstate(over='ignore'):
+        z = np.arange(1, count + 1, dtype=np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+def command_heatmap(pcs, program_length):
+    # Number of times each command was executed, from the pc column of a trace
+    return np.bincount(pcs, minlength=program_length)[:program_length]
+
+@lru_cache(maxsize=1 << 12)
+def cell_weight(index):
+    # Pseudo random 64 bit weight of a cell (splitmix64). The tape hash is the sum of value * weight over all cells,
+    # so a write only has to add (new - old) * weight, and the hash never depends on the order of the writes
+    # Loops write the same few cells over and over, so a small cache is enough, and a long tape doesn't fill it
+    z = (index * 0x9E3779B97F4A7C15 + 0x9E3779B97F4A7C15) & HASH_MASK
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & HASH_MASK
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & HASH_MASK
+    return z ^ (z >> 31)
 
 class Visualnterpreter:
     INTERPRETER_OFFSET_Y = 0
 
     code = []
-    jumpmap = {}
-    cells = []
+    program = ''
+    pc_line = []
+    pc_char = []
+    pc_x = []
+    line_start = []
+    jumpmap = []
+    depth = []
+    fused = []
+    open_brackets = []
+    unmatched_closes = []
+    bracket_error = None
+    # The tape is a bytearray that grows geometrically, only the first tape_length cells have been visited
+    # Only checkpoints are paged. Every visited cell costs a byte here, even when it is never written, because
+    # looking up a page on every command would slow all programs down to save memory for a few.
+    cells = bytearray()
+    tape_length = 0
     cell_pointer = 0
-    code_pointer_char = 0
-    code_pointer_line = 0
+    pc = 0
+    last_pc = None
     finished = False
     debug_slowdown_count = 0
     debug_slowdown_factor = 3
-    in_loop_level = 0
     last_movement_forward = True
-    history = []
+    mode = 'watch'
+    frame_budget = 0.015
+    seek_budget = 0.25
+    breakpoints = set()
+    # print_cells shows view_cells cells from view_offset, which scrolls to keep the cell pointer in view
+    view_cells = 8
+    view_offset = 0
+    # Optionally a heatmap of the whole tape too, sampled down to heatmap_width cells
+    tape_heatmap = False
+    heatmap_width = 640
+
+    # Time travel: an undo log with one entry per executed instruction, and full copies of the tape now and then
+    keep_history = True
+    history_limit = 200000
+    checkpoint_interval = 10000
+    # Doubled every time the checkpoints are thinned out, back to checkpoint_interval when the program restarts
+    checkpoint_spacing = checkpoint_interval
+    checkpoint_limit = 32
+    step_count = 0
+    output = []
+    output_steps = array('q')
+    # Checkpoints keep the length of the output, and share the output lists of the run. Those lists are only ever
+    # appended to while shared, going back in time cuts a copy of them instead.
+    output_shared = False
+    log_base = 0
+    log_pc = array('i')
+    log_last_pc = array('i')
+    log_pointer = array('i')
+    log_length = array('i')
+    log_value = array('B')
+    log_steps = array('q')
+    log_output = array('i')
+    log_extra = {}
+    checkpoints = []
+    checkpoint_steps = []
+    next_checkpoint = 0
+    # Nothing at or after program index reach has been read yet, so the state is the same for any program with
+    # the same first reach commands. A run stays clean as long as the code was only changed after its reach.
+    reach = 0
+    run_clean = True
+
+    # Restarting resumes from the deepest checkpoint of earlier runs that the new program would also have reached.
+    # Keyed by (reach, hash of the first reach commands, step)
+    # In watch mode the program is only resumed when it changed, so restarting the same program shows it from the start
+    resume_from_cache = True
+    prepared_program = None
+    prefix_cache = {}
+    prefix_cache_limit = 128
+    prefix_cache_bytes = 64 << 20
+
+    # Tracing runs one command at a time, and records each in preallocated columns that double when full
+    tracing = False
+    trace_length = 0
+    trace_step = np.empty(0, np.int64)
+    trace_pc = np.empty(0, np.int32)
+    trace_pointer = np.empty(0, np.int32)
+    trace_value = np.empty(0, np.uint8)
+    trace_output = np.empty(0, np.int16)
+
+    # The code shown while running is drawn once into a text layer, and redrawn when the code changes
+    code_layer = None
+    code_layer_key = (None, None, None)
+
+    # Watchdog: every time a loop jumps back, its state (pc, cell pointer, tape hash) is compared to a saved state,
+    # Brent style, saving a new state after 1, 2, 4, 8... jumps. A loop that is back in a state it was in before
+    # will never end. step_limit optionally pauses any program after that many steps, with or without the watchdog.
+    watchdog = True
+    step_limit = None
+    tape_hash = 0
+    tape_weights = np.empty(0, np.uint64)
+    watch_state = None
+    watch_power = 1
+    watch_length = 0
+    watch_loop_start = None
+    stuck_loop = None
+    step_limit_reached = False
 
     def build_jumpmap(self):
-        temp_jumpstack, jumpmap = [], {}
+        if self.bracket_error is not None:
+            return False, self.bracket_error
+        return True, None
+
+    def input_code(self, code, line_x = None):
+        # line_x optionally has the x offset of every character on each line, as from CodeLayout.wrap
+        if code == self.code:
+            return
+        self.code = code
+        program = ''.join(command for code_line in code for command in code_line if command in COMMANDS)
+        if program != self.program:
+            if self.reach > len(os.path.commonprefix([program, self.program])):
+                self.run_clean = False
+            self.update_code(program)
+            self.forget_future()
+            self.reset_watchdog()
+            self.breakpoints = {pc for pc in self.breakpoints if pc < len(program)}
+        self.build_layout(line_x)
+
+    def build_layout(self, line_x = None):
+        pc_line, pc_char, pc_x, line_start = [], [], [], []
         for line_number, code_line in enumerate(self.code):
+            line_start.append(len(pc_line))
+            x = line_x[line_number] if line_x is not None else CODE_GLYPHS.offsets(code_line)
             for char_number, command in enumerate(code_line):
-                if command == '[': 
-                    temp_jumpstack.append((char_number, line_number))
-                if command == ']':
-                    if len(temp_jumpstack) == 0:
-                        #print('Syntax error: Can\'t close a loop that hasn\'t started yet!')
-                        return False, (line_number, char_number)
-                    start = temp_jumpstack.pop()
-                    jumpmap[start] = (char_number, line_number)
-                    jumpmap[(char_number, line_number)] = start
-        if len (temp_jumpstack) > 0:
-            (char_number, line_number) = temp_jumpstack.pop()
+                if command in COMMANDS:
+                    pc_line.append(line_number)
+                    pc_char.append(char_number)
+                    pc_x.append(x[char_number])
+        line_start.append(len(pc_line))
+        self.pc_line = pc_line
+        self.pc_char = pc_char
+        self.pc_x = pc_x
+        self.line_start = line_start
+
+    def pc_to_screen(self, pc):
+        # Returns (line, char, x offset) of the command at pc
+        if pc is None or pc < 0 or pc >= len(self.pc_line):
+            return None
+        return self.pc_line[pc], self.pc_char[pc], self.pc_x[pc]
+
+    def screen_to_pc(self, line_number, char_number):
+        # Returns the pc of the first command at or after char_number on the line
+        if line_number < 0 or line_number >= len(self.line_start) - 1:
+            return None
+        start, end = self.line_start[line_number], self.line_start[line_number + 1]
+        pc = bisect_left(self.pc_char, char_number, start, end)
+        return pc if pc < end else None
+
+    def compile_code(self):
+        # Full compile, only needed when the program changed somewhere else than at the end
+        self.jumpmap, self.depth, self.fused = [], [], []
+        self.open_brackets, self.unmatched_closes = [], []
+        self.append_brackets(0)
+        self.fused = [None] * len(self.program)
+        self.compile_fused(0)
+
+    def update_code(self, program):
+        # Live coding only appends or deletes at the end, so keep the compiled code for the unchanged part
+        old_length = len(self.program)
+        if old_length > 0 and program.startswith(self.program):
+            self.program = program
+            closed = self.append_brackets(old_length)
+            self.fused.extend([None] * (len(program) - old_length))
+            self.compile_fused(self.run_start(old_length))
+            for start in closed:
+                if start < old_length:
+                    self.fused[start] = self.compile_loop(start, self.jumpmap[start])
+        elif self.program.startswith(program):
+            self.remove_brackets(len(program))
+            self.program = program
+            del self.fused[len(program):]
+            if len(program) > 0:
+                self.compile_fused(self.run_start(len(program) - 1))
+        else:
+            self.program = program
+            self.compile_code()
+
+    def append_brackets(self, start):
+        # Index brackets from start to the end of the program, in O(1) per command
+        # Returns the start of each loop closed
+        closed = []
+        for pc in range(start, len(self.program)):
+            command = self.program[pc]
+            # A [ belongs to the loop outside it, a ] to the loop it closes
+            self.depth.append(len(self.open_brackets))
+            self.jumpmap.append(-1)
+            if command == '[':
+                self.open_brackets.append(pc)
+            elif command == ']':
+                if len(self.open_brackets) == 0:
+                    #print('Syntax error: Can\'t close a loop that hasn\'t started yet!')
+                    self.unmatched_closes.append(pc)
+                    continue
+                loop_start = self.open_brackets.pop()
+                self.jumpmap[loop_start] = pc
+                self.jumpmap[pc] = loop_start
+                closed.append(loop_start)
+        self.update_bracket_error()
+        return closed
+
+    def remove_brackets(self, start):
+        # Forget brackets from start to the end of the program, last first, in O(1) per command
+        for pc in range(len(self.program) - 1, start - 1, -1):
+            command = self.program[pc]
+            if command == '[':
+                # Nothing after it is left, so it can't be matched
+                self.open_brackets.pop()
+            elif command == ']':
+                loop_start = self.jumpmap[pc]
+                if loop_start == -1:
+                    self.unmatched_closes.pop()
+                else:
+                    self.jumpmap[loop_start] = -1
+                    self.fused[loop_start] = None
+                    self.open_brackets.append(loop_start)
+            self.jumpmap.pop()
+            self.depth.pop()
+        self.update_bracket_error()
+
+    def update_bracket_error(self):
+        if len(self.unmatched_closes) > 0:
+            self.bracket_error = self.unmatched_closes[0]
+        elif len(self.open_brackets) > 0:
             #print('Syntax error: Unclosed loop detected!')
-            return False, (line_number, char_number)
-        self.jumpmap = jumpmap
-        return True, (0, 0)
+            self.bracket_error = self.open_brackets[-1]
+        else:
+            self.bracket_error = None
 
-    def input_code(self, code):
-        self.code = code
+    def run_start(self, pc):
+        # First index of the run of + and -, > or < that pc is part of
+        kind = '+-' if self.program[pc] in '+-' else self.program[pc]
+        if kind not in ('+-', '>', '<'):
+            return pc
+        while pc > 0 and self.program[pc - 1] in kind:
+            pc -= 1
+        return pc
+
+    def compile_fused(self, start):
+        # Fold runs, clear loops and multiply loops. Every program index gets the longest instruction
+        # starting there, so execution can continue from any index, even halfway into a run.
+        program = self.program
+        length = len(program)
+        fused = self.fused
+        run_end = length
+        for pc in range(length - 1, start - 1, -1):
+            command = program[pc]
+            if command in '+-':
+                if pc + 1 < length and program[pc + 1] in '+-':
+                    delta = fused[pc + 1][1]
+                else:
+                    run_end, delta = pc + 1, 0
+                delta = (delta + (1 if command == '+' else -1)) % 256
+                fused[pc] = (OP_ADD, delta, run_end)
+            elif command in '<>':
+                if pc + 1 < length and program[pc + 1] == command:
+                    count = abs(fused[pc + 1][1])
+                else:
+                    run_end, count = pc + 1, 0
+                fused[pc] = (OP_MOVE, (count + 1) * (1 if command == '>' else -1), run_end)
+            elif command == '[' and self.jumpmap[pc] != -1:
+                fused[pc] = self.compile_loop(pc, self.jumpmap[pc])
+            else:
+                fused[pc] = None
+
+    def compile_loop(self, start, end):
+        body = self.program[start + 1:end]
+        if body in ('-', '+'):
+            return (OP_CLEAR, 1 if body == '+' else 255, end + 1)
+        # The furthest cells the body moves to, even without changing them, decide if it is safe to multiply,
+        # and how far the tape grows
+        offset, factors = 0, {}
+        min_offset = max_offset = 0
+        for command in body:
+            if command == '>':
+                offset += 1
+                max_offset = max(max_offset, offset)
+            elif command == '<':
+                offset -= 1
+                min_offset = min(min_offset, offset)
+            elif command in '+-':
+                factors[offset] = (factors.get(offset, 0) + (1 if command == '+' else -1)) % 256
+            else:
+                return None
+        # Only loops that return to the counter cell and count it down, or up, by one can be multiplied
+        counter = factors.pop(0, 0)
+        if offset != 0 or counter not in (1, 255):
+            return None
+        return (OP_MULTIPLY, (counter, tuple(factors.items()), min_offset, max_offset), end + 1)
 
     def prepare_code(self):
-        ok, (l, c) = self.build_jumpmap()
+        ok, error_pc = self.build_jumpmap()
         if not ok:
-            return False, (l, c)
-        self.cells = []
+            return False, error_pc
+        if self.keep_history and self.run_clean:
+            self.cache_checkpoint(self.make_checkpoint(self.checkpoints[-1] if len(self.checkpoints) > 0 else None))
+        self.cells = bytearray(64)
+        self.tape_length = 0
         self.cell_pointer = 0
-        self.code_pointer_char = -1
-        self.code_pointer_line = 0
+        self.view_offset = 0
+        self.pc = 0
+        self.last_pc = None
         self.debug_slowdown_count = 0
         self.finished = False
-        self.in_loop_level = 0
-        self.history = []
-        return True, (l, c)
+        self.step_count = 0
+        self.output = []
+        self.output_steps = array('q')
+        self.output_shared = False
+        self.clear_log()
+        self.checkpoints = []
+        self.checkpoint_steps = []
+        self.checkpoint_spacing = self.checkpoint_interval
+        self.next_checkpoint = 0
+        self.reach = 0
+        self.run_clean = True
+        self.trace_length = 0
+        self.add_checkpoint()
+        self.tape_hash = 0
+        self.reset_watchdog()
+        changed = self.program != self.prepared_program
+        self.prepared_program = self.program
+        if self.keep_history and self.resume_from_cache and (changed or self.mode != 'watch'):
+            self.resume_cached()
+        return True, error_pc
 
-    def step(self, single_step = False):
-        # No code
-        if len(self.code) == 0:
-            #print('No code to execute')
-            return True, False, 0, 0, ''
+    def grow_cells(self, cell_pointer):
+        # Dynamically add more cells as needed
+        if cell_pointer >= self.tape_length:
+            if cell_pointer >= len(self.cells):
+                self.cells.extend(bytes(max(len(self.cells), cell_pointer + 1 - len(self.cells))))
+            self.tape_length = cell_pointer + 1
 
-        # Step, step, step
-        if not single_step and self.in_loop_level == 0 and self.debug_slowdown_count % self.debug_slowdown_factor != 0:
-            self.debug_slowdown_count += 1
-            return False, False, self.code_pointer_char, self.code_pointer_line, '' 
-        else:
-            self.debug_slowdown_count = 1
-            if self.code_pointer_char == None:
-                self.code_pointer_char = 0
-                self.code_pointer_line = 0
-            elif len(self.code) >= self.code_pointer_line and self.code_pointer_char < len(self.code[self.code_pointer_line]) - 1:
-                self.code_pointer_char += 1
-            elif self.code_pointer_line < len(self.code):
-                self.code_pointer_char = 0
-                self.code_pointer_line += 1
-
-        # Point past last line
-        if self.code_pointer_line >= len(self.code) or self.code_pointer_char >= len(self.code[self.code_pointer_line]):
-            self.code_pointer_char = len(self.code[self.code_pointer_line - 1])
-            self.code_pointer_line = len(self.code) - 1
-            return True, True, self.code_pointer_char, self.code_pointer_line, ''       
-
-        command = self.code[self.code_pointer_line][self.code_pointer_char]
-
-        # Handle formatted with single spaces, never double
-        if command == ' ':
-            self.code_pointer_char += 1
-            command = self.code[self.code_pointer_line][self.code_pointer_char]
-
-        char = self.code_pointer_char
-        line = self.code_pointer_line
+    def tape_view(self, start = 0, stop = None):
+        # Zero-copy view of the visited cells, only valid until the tape grows
+        stop = self.tape_length if stop is None else min(stop, self.tape_length)
+        return memoryview(self.cells)[min(start, stop):stop]
+
+    def execute(self, max_steps = 1):
+        # Execute the instruction at pc, using a compiled instruction if it needs no more than max_steps steps
+        # Returns the number of steps taken and any output
+        pc, cell_pointer, length = self.pc, self.cell_pointer, self.tape_length
+        self.grow_cells(cell_pointer)
+        value = self.cells[cell_pointer]
+        if self.tracing:
+            max_steps = 1
+        steps, output, last_pc = self.execute_instruction(max_steps)
+        if steps == 0:
+            return 0, ''
+        if self.tracing:
+            self.record_trace(pc, cell_pointer, output)
+        # A ] that jumped back was read too, though the pc is now before it
+        if self.pc > self.reach:
+            self.reach = self.pc
+        if last_pc >= self.reach:
+            self.reach = last_pc + 1
+
+        # Only the current cell is changed, except by multiply loops that log the other cells themselves
+        if self.keep_history:
+            self.log_pc.append(pc)
+            self.log_last_pc.append(-1 if self.last_pc is None else self.last_pc)
+            self.log_pointer.append(cell_pointer)
+            self.log_length.append(length)
+            self.log_value.append(value)
+            self.log_steps.append(self.step_count)
+            self.log_output.append(len(self.output))
+            if len(self.log_pc) > self.history_limit:
+                self.drop_log(len(self.log_pc) - self.history_limit + self.history_limit // 4)
+
+        self.last_pc = last_pc
+        self.step_count += steps
+        if output:
+            self.output.append(output)
+            self.output_steps.append(self.step_count)
+        if self.keep_history and self.step_count >= self.next_checkpoint:
+            self.add_checkpoint()
+        if self.step_limit is not None and self.step_count >= self.step_limit > self.step_count - steps:
+            self.step_limit_reached = True
+        if self.watchdog:
+            if self.cells[cell_pointer] != value:
+                self.tape_hash = (self.tape_hash + (self.cells[cell_pointer] - value) * cell_weight(cell_pointer)) & HASH_MASK
+            # Only a ] jumping back moves the pc backwards
+            if self.pc <= pc:
+                self.watch_loop(pc)
+        return steps, output
+
+    def watch_loop(self, pc):
+        # Called after the ] at pc jumped back
+        loop_start = self.jumpmap[pc]
+        if self.watch_loop_start is None or loop_start < self.watch_loop_start:
+            self.watch_loop_start = loop_start
+        state = (self.pc, self.cell_pointer, self.tape_hash)
+        if state == self.watch_state:
+            # The outermost loop that jumped back since the saved state is the one that never ends
+            self.stuck_loop = (self.watch_loop_start, self.jumpmap[self.watch_loop_start])
+            return
+        self.watch_length += 1
+        if self.watch_length == self.watch_power:
+            self.watch_state = state
+            self.watch_power *= 2
+            self.watch_length = 0
+            self.watch_loop_start = None
+
+    def start_trace(self, capacity = 1 << 16):
+        self.trace_step = np.empty(capacity, np.int64)
+        self.trace_pc = np.empty(capacity, np.int32)
+        self.trace_pointer = np.empty(capacity, np.int32)
+        self.trace_value = np.empty(capacity, np.uint8)
+        self.trace_output = np.empty(capacity, np.int16)
+        self.trace_length = 0
+        self.tracing = True
+
+    def stop_trace(self):
+        self.tracing = False
+
+    def record_trace(self, pc, cell_pointer, output):
+        # Called before step_count counts the command
+        row = self.trace_length
+        if row == len(self.trace_pc):
+            for name in TRACE_DTYPE.names:
+                column = getattr(self, 'trace_' + name)
+                grown = np.empty(max(len(column) * 2, 1024), column.dtype)
+                grown[:row] = column
+                setattr(self, 'trace_' + name, grown)
+        self.trace_step[row] = self.step_count
+        self.trace_pc[row] = pc
+        self.trace_pointer[row] = cell_pointer
+        self.trace_value[row] = self.cells[cell_pointer]
+        self.trace_output[row] = ord(output) if output else -1
+        self.trace_length = row + 1
+
+    def truncate_trace(self):
+        # Forget the commands undone by travelling back in time, they are recorded again when replayed
+        self.trace_length = int(np.searchsorted(self.trace_step[:self.trace_length], self.step_count))
+
+    def save_trace(self, path):
+        # Written column by column straight into the file, without building the rows in memory
+        trace = np.lib.format.open_memmap(path, mode='w+', dtype=TRACE_DTYPE, shape=(self.trace_length,))
+        for name in TRACE_DTYPE.names:
+            trace[name] = getattr(self, 'trace_' + name)[:self.trace_length]
+        trace.flush()
+        del trace
+
+    def reset_watchdog(self):
+        # Forget the loop states seen, after restarting, travelling in time or changing the code
+        self.watch_state = None
+        self.watch_power = 1
+        self.watch_length = 0
+        self.watch_loop_start = None
+        self.stuck_loop = None
+        self.step_limit_reached = False
+
+    def rehash_tape(self):
+        # Only the watchdog reads the hash. Computed in one pass with the weights of the cells kept in an array.
+        if not self.watchdog:
+            return
+        length = self.tape_length
+        if len(self.tape_weights) < length:
+            self.tape_weights = cell_weights(max(length, 2 * len(self.tape_weights)))
+        tape = np.frombuffer(self.cells, np.uint8, count=length)
+        with np.errstate(over='ignore'):
+            self.tape_hash = int(np.sum(tape * self.tape_weights[:length], dtype=np.uint64))
+        # Let go of the buffer, a bytearray can't grow while it is exported
+        del tape
+
+    def watchdog_alarm(self):
+        return self.stuck_loop is not None or self.step_limit_reached
+
+    def execute_instruction(self, max_steps):
+        # Returns the number of steps, any output and the pc of the last command executed
+        pc = self.pc
+        cells = self.cells
+        instruction = self.fused[pc] if max_steps > 1 else None
+        if instruction is not None:
+            kind, argument, end = instruction
+            if kind == OP_ADD and end - pc <= max_steps:
+                cells[self.cell_pointer] = (cells[self.cell_pointer] + argument) % 256
+                self.pc = end
+                return end - pc, '', end - 1
+            if kind == OP_MOVE and end - pc <= max_steps:
+                self.cell_pointer = max(self.cell_pointer + argument, 0)
+                self.grow_cells(self.cell_pointer)
+                self.pc = end
+                return end - pc, '', end - 1
+            if kind == OP_CLEAR or kind == OP_MULTIPLY:
+                counter, factors, min_offset, max_offset = argument if kind == OP_MULTIPLY else (argument, (), 0, 0)
+                value = cells[self.cell_pointer]
+                iterations = value if counter == 255 else (256 - value) % 256
+                steps = 1 + iterations * (end - pc - 1)
+                # Moving left of cell 0 is clamped, and that would change the loop, so run it step by step
+                if steps <= max_steps and self.cell_pointer + min_offset >= 0:
+                    if iterations > 0:
+                        self.grow_cells(self.cell_pointer + max_offset)
+                        if self.keep_history:
+                            self.log_extra[self.log_base + len(self.log_pc)] = [(self.cell_pointer + offset, cells[self.cell_pointer + offset]) for offset, _ in factors]
+                        for offset, factor in factors:
+                            cell = self.cell_pointer + offset
+                            new_value = (cells[cell] + iterations * factor) % 256
+                            if self.watchdog:
+                                self.tape_hash = (self.tape_hash + (new_value - cells[cell]) * cell_weight(cell)) & HASH_MASK
+                            cells[cell] = new_value
+                        cells[self.cell_pointer] = 0
+                    self.pc = end
+                    return steps, '', end - 1 if iterations > 0 else pc
+
+        command = self.program[pc]
         output = ''
+        self.pc = pc + 1
 
         if command == ">":
-            self.cell_pointer += 1           
-
-        # Dynamically add more cells as needed
-        while self.cell_pointer >= len(self.cells):
-            self.cells.append(0)
+            self.cell_pointer += 1
+            self.grow_cells(self.cell_pointer)
 
         if command == "<":
             if self.cell_pointer <= 0:
@@ -112,53 +631,346 @@ class Visualnterpreter:
                 self.cell_pointer -= 1
 
         if command == "+":
-            self.cells[self.cell_pointer] += 1 
-            if self.cells[self.cell_pointer] > 255:
-                self.cells[self.cell_pointer] = 0
+            cells[self.cell_pointer] = (cells[self.cell_pointer] + 1) % 256
 
         if command == "-":
-            self.cells[self.cell_pointer] -= 1
-            if self.cells[self.cell_pointer] < 0:
-                self.cells[self.cell_pointer] = 255
-
-        if command == "[":
-            if self.cells[self.cell_pointer] == 0: 
-                self.code_pointer_char, self.code_pointer_line = self.jumpmap[(char, line)]
-            else:
-                self.in_loop_level += 1
+            cells[self.cell_pointer] = (cells[self.cell_pointer] - 1) % 256
 
-        if command == "]":
-            if self.cells[self.cell_pointer] != 0: 
-                self.code_pointer_char, self.code_pointer_line = self.jumpmap[(char, line)]
-            else:
-                self.in_loop_level -= 1
+        if command == "[" or command == "]":
+            jump = (cells[self.cell_pointer] == 0) == (command == "[")
+            if jump:
+                if self.jumpmap[pc] == -1:
+                    # Unmatched bracket, halt here until the code is fixed
+                    self.pc = pc
+                    return 0, '', pc
+                self.pc = self.jumpmap[pc] + 1
 
         if command == ".": 
-            output = chr(self.cells[self.cell_pointer])
+            output = chr(cells[self.cell_pointer])
+
+        return 1, output, pc
+
+    def step(self, single_step = False):
+        # No code
+        if len(self.program) == 0:
+            #print('No code to execute')
+            return True, False, None, ''
 
+        self.stuck_loop = None
+        self.step_limit_reached = False
+
+        # Step, step, step
+        if not single_step and self.depth_at(self.pc) == 0 and self.debug_slowdown_count % self.debug_slowdown_factor != 0:
+            self.debug_slowdown_count += 1
+            return False, False, self.last_pc, ''
+        self.debug_slowdown_count = 1
+
+        # Point past last command
+        if self.pc >= len(self.program):
+            self.pc = len(self.program)
+            return True, True, self.last_pc, ''
+
+        pc = self.pc
+        steps, output = self.execute()
+        if steps == 0:
+            return False, False, self.last_pc, ''
+        self.last_movement_forward = True
+        return False, True, pc, output
+
+    def run(self, max_steps):
+        # Fast forward up to max_steps steps, using the compiled instructions
+        outputs = []
+        steps = 0
+        self.stuck_loop = None
+        self.step_limit_reached = False
+        while steps < max_steps and self.pc < len(self.program):
+            taken, output = self.execute(max_steps - steps)
+            if taken == 0:
+                break
+            steps += taken
+            if output:
+                outputs.append(output)
+            if self.stuck_loop is not None or self.step_limit_reached:
+                break
         self.last_movement_forward = True
-        return False, True, self.code_pointer_char, self.code_pointer_line, output
+        return self.pc >= len(self.program), steps > 0, self.last_pc, ''.join(outputs)
+
+    def toggle_breakpoint(self, pc):
+        if pc is None:
+            return
+        self.breakpoints = self.breakpoints ^ {pc}
+
+    def max_steps_at(self, pc):
+        # Don't let a compiled instruction run past a breakpoint, or past the step limit
+        instruction = self.fused[pc]
+        if instruction is not None and len(self.breakpoints) > 0:
+            if any(pc < breakpoint < instruction[2] for breakpoint in self.breakpoints):
+                return 1
+        if self.step_limit is not None and self.step_count < self.step_limit:
+            return self.step_limit - self.step_count
+        return sys.maxsize
+
+    def run_frame(self):
+        # Run the interpreter for one frame, paced by the mode
+        # Returns the same as step, and if a breakpoint, an output in run mode or the watchdog paused the interpreter
+        if self.mode == 'watch':
+            finished, remember, pc, output = self.step()
+            return finished, remember, pc, output, remember and (self.pc in self.breakpoints or self.watchdog_alarm())
+
+        if len(self.program) == 0:
+            return True, False, None, '', False
+        deadline = time.perf_counter() + self.frame_budget
+        outputs = []
+        steps = 0
+        stopped = False
+        count = 0
+        self.stuck_loop = None
+        self.step_limit_reached = False
+        while self.pc < len(self.program):
+            taken, output = self.execute(self.max_steps_at(self.pc))
+            if taken == 0:
+                break
+            steps += taken
+            if output:
+                outputs.append(output)
+            if self.pc in self.breakpoints or (output and self.mode == 'run') or self.stuck_loop is not None or self.step_limit_reached:
+                stopped = True
+                break
+            # Reading the clock is slow compared to a command, so only do it now and then
+            count += 1
+            if count % 256 == 0 and time.perf_counter() > deadline:
+                break
+        self.last_movement_forward = True
+        return self.pc >= len(self.program), steps > 0, self.last_pc, ''.join(outputs), stopped
+
+    def snapshot(self):
+        if self.cell_pointer < self.view_offset:
+            self.view_offset = self.cell_pointer
+        elif self.cell_pointer >= self.view_offset + self.view_cells:
+            self.view_offset = self.cell_pointer - self.view_cells + 1
+        cells = bytes(self.tape_view(self.view_offset, self.view_offset + self.view_cells))
+        return InterpreterSnapshot(self.pc, self.last_pc, self.cell_pointer, self.view_offset, cells, self.tape_length,
+                                   ''.join(self.output), self.pc >= len(self.program), self.step_count, self.mode,
+                                   self.stuck_loop, self.step_limit_reached, self.tape_heat() if self.tape_heatmap else None)
+
+    def tape_heat(self):
+        # The tape sampled down to at most heatmap_width cells, keeping the highest value of each bucket
+        tape = np.frombuffer(self.cells, np.uint8, count=self.tape_length)
+        if len(tape) <= self.heatmap_width:
+            heat = tape.tobytes()
+        else:
+            heat = np.maximum.reduceat(tape, np.arange(self.heatmap_width) * len(tape) // self.heatmap_width).tobytes()
+        # Let go of the buffer, a bytearray can't grow while it is exported
+        del tape
+        return heat
+
+    def depth_at(self, pc):
+        if pc >= len(self.depth):
+            return 0
+        return self.depth[pc]
+
+    def clear_log(self):
+        self.log_base = 0
+        self.log_pc = array('i')
+        self.log_last_pc = array('i')
+        self.log_pointer = array('i')
+        self.log_length = array('i')
+        self.log_value = array('B')
+        self.log_steps = array('q')
+        self.log_output = array('i')
+        self.log_extra = {}
+
+    def drop_log(self, count):
+        # Forget the oldest entries, the checkpoints still let us travel back past them
+        for column in (self.log_pc, self.log_last_pc, self.log_pointer, self.log_length, self.log_value, self.log_steps, self.log_output):
+            del column[:count]
+        self.log_base += count
+        self.log_extra = {index: cells for index, cells in self.log_extra.items() if index >= self.log_base}
+
+    def undo(self):
+        # Undo the last logged instruction
+        index = self.log_base + len(self.log_pc) - 1
+        for cell, value in self.log_extra.pop(index, ()):
+            self.cells[cell] = value
+        self.cell_pointer = self.log_pointer.pop()
+        self.cells[self.cell_pointer] = self.log_value.pop()
+        length = self.log_length.pop()
+        self.cells[length:self.tape_length] = bytes(self.tape_length - length)
+        self.tape_length = length
+        self.pc = self.log_pc.pop()
+        last_pc = self.log_last_pc.pop()
+        self.last_pc = None if last_pc == -1 else last_pc
+        self.step_count = self.log_steps.pop()
+        output_length = self.log_output.pop()
+        self.truncate_output(output_length)
+
+    def truncate_output(self, length):
+        if length >= len(self.output):
+            return
+        if self.output_shared:
+            self.output = self.output[:length]
+            self.output_steps = self.output_steps[:length]
+            self.output_shared = False
+        else:
+            del self.output[length:]
+            del self.output_steps[length:]
+
+    def make_checkpoint(self, previous = None):
+        # The tape is stored as (length, page table), sharing unchanged pages with the previous checkpoint
+        # The output is stored as (length, the output lists of the run)
+        pages = tape_pages(self.tape_view(), previous[4][1] if previous is not None else ())
+        self.output_shared = True
+        return (self.step_count, self.pc, self.last_pc, self.cell_pointer, (self.tape_length, pages),
+                (len(self.output), (self.output, self.output_steps)), self.reach)
+
+    def add_checkpoint(self):
+        index = bisect_left(self.checkpoint_steps, self.step_count)
+        if index == len(self.checkpoint_steps) or self.checkpoint_steps[index] != self.step_count:
+            checkpoint = self.make_checkpoint(self.checkpoints[index - 1] if index > 0 else None)
+            self.checkpoints.insert(index, checkpoint)
+            self.checkpoint_steps.insert(index, self.step_count)
+            if self.run_clean:
+                self.cache_checkpoint(checkpoint)
+            if len(self.checkpoints) > self.checkpoint_limit:
+                # Keep memory bounded by keeping every other checkpoint, and taking them half as often
+                self.checkpoints = self.checkpoints[::2]
+                self.checkpoint_steps = self.checkpoint_steps[::2]
+                self.checkpoint_spacing *= 2
+        self.next_checkpoint = (self.step_count // self.checkpoint_spacing + 1) * self.checkpoint_spacing
+
+    def nearest_checkpoint(self, step):
+        # Step of the last checkpoint at or before step
+        index = bisect_right(self.checkpoint_steps, step) - 1
+        return self.checkpoint_steps[index] if index >= 0 else None
+
+    def restore_checkpoint(self, step):
+        # Restore the last checkpoint at or before step
+        index = bisect_right(self.checkpoint_steps, step) - 1
+        if index < 0:
+            return False
+        self.load_checkpoint(self.checkpoints[index])
+        return True
+
+    def load_checkpoint(self, checkpoint):
+        self.step_count, self.pc, self.last_pc, self.cell_pointer, (length, pages), (output_length, (output, output_steps)), reach = checkpoint
+        # Commands read before travelling back in time were still read
+        self.reach = max(self.reach, reach)
+        self.cells = bytearray(length)
+        for index, page in enumerate(pages):
+            if page is not None:
+                self.cells[index * PAGE_SIZE:index * PAGE_SIZE + len(page)] = page
+        self.tape_length = length
+        # A copy, the lists may be longer than the checkpoint, and other checkpoints may still need that
+        self.output = output[:output_length]
+        self.output_steps = output_steps[:output_length]
+        self.output_shared = False
+        self.clear_log()
+        self.next_checkpoint = (self.step_count // self.checkpoint_spacing + 1) * self.checkpoint_spacing
+
+    def cache_checkpoint(self, checkpoint):
+        step, reach = checkpoint[0], checkpoint[-1]
+        # A new dict, the empty one is shared by the class
+        prefix_cache = dict(self.prefix_cache)
+        prefix_cache[(reach, hash(self.program[:reach]), step)] = checkpoint
+        # Forget the oldest, dicts keep insertion order, until both the count and the memory fit
+        if len(prefix_cache) > self.prefix_cache_limit:
+            del prefix_cache[next(iter(prefix_cache))]
+        while len(prefix_cache) > 1 and checkpoint_bytes(prefix_cache.values()) > self.prefix_cache_bytes:
+            del prefix_cache[next(iter(prefix_cache))]
+        self.prefix_cache = prefix_cache
+
+    def resume_cached(self):
+        # Continue from the deepest cached checkpoint that the program would also have reached, and
+        # keep the earlier ones of the same run, so stepping back still works
+        if len(self.prefix_cache) == 0:
+            return
+        prefix_hashes = {}
+        valid = {}
+        for (reach, prefix_hash, step), checkpoint in self.prefix_cache.items():
+            if reach > len(self.program):
+                continue
+            if reach not in prefix_hashes:
+                prefix_hashes[reach] = hash(self.program[:reach])
+            if prefix_hashes[reach] == prefix_hash:
+                valid[step] = checkpoint
+        if len(valid) <= 1:
+            return
+        checkpoints = [valid[step] for step in sorted(valid)]
+        while len(checkpoints) > self.checkpoint_limit:
+            checkpoints = checkpoints[::-2][::-1]
+        self.checkpoints = checkpoints
+        self.checkpoint_steps = [checkpoint[0] for checkpoint in checkpoints]
+        self.reach = 0
+        self.load_checkpoint(checkpoints[-1])
+        self.rehash_tape()
+
+    def forget_future(self):
+        # Checkpoints ahead of the current step were made with the old code
+        index = bisect_right(self.checkpoint_steps, self.step_count)
+        del self.checkpoints[index:]
+        del self.checkpoint_steps[index:]
+
+    def replay(self, step):
+        # Run forward until step, using compiled instructions where they fit
+        while self.step_count < step and self.pc < len(self.program):
+            if self.execute(step - self.step_count)[0] == 0:
+                break
+
+    def seek(self, step):
+        # Jump straight to step, by undoing or by restoring the nearest checkpoint, and replaying from there
+        # Returns the same as step_back, with the complete output so far
+        step = max(step, 0)
+        checkpoint = self.nearest_checkpoint(step)
+        if step < self.step_count:
+            # Undo if the log reaches back far enough, and that is less work than replaying from the checkpoint
+            can_undo = len(self.log_steps) > 0 and self.log_steps[0] <= step
+            undo_count = len(self.log_steps) - bisect_left(self.log_steps, step)
+            if can_undo and (checkpoint is None or undo_count <= step - checkpoint):
+                while self.step_count > step:
+                    self.undo()
+            else:
+                self.restore_checkpoint(step)
+        elif checkpoint is not None and checkpoint > self.step_count:
+            # A checkpoint from before we travelled back in time
+            self.restore_checkpoint(step)
+        if self.tracing:
+            self.truncate_trace()
+        # A compiled instruction can take many steps, redo all but the last one
+        self.replay(step)
+        self.rehash_tape()
+        self.reset_watchdog()
+        self.last_movement_forward = step >= self.step_count
+        return self.pc >= len(self.program), False, self.last_pc, ''.join(self.output)
+
+    def seek_output(self, index):
+        # Jump to the step where output character number index was produced
+        if index < 0:
+            return self.seek(0)
+        if index < len(self.output):
+            return self.seek(self.output_steps[index])
+        # Run forward like run_frame, stopping at breakpoints, the watchdog and the step limit, and giving up
+        # after seek_budget seconds, so the render loop waiting for the lock is never stuck
+        deadline = time.perf_counter() + self.seek_budget
+        count = 0
+        self.stuck_loop = None
+        self.step_limit_reached = False
+        while len(self.output) <= index and self.pc < len(self.program):
+            if self.execute(self.max_steps_at(self.pc))[0] == 0:
+                break
+            if self.pc in self.breakpoints or self.watchdog_alarm():
+                break
+            count += 1
+            if count % 256 == 0 and time.perf_counter() > deadline:
+                break
+        self.last_movement_forward = True
+        return self.pc >= len(self.program), False, self.last_pc, ''.join(self.output)
 
-    def history_append(self, historic_output):
-        if self.code_pointer_line <= len(self.code) and self.code_pointer_char <= len(self.code[self.code_pointer_line]):
-            self.history.append((False, False, self.code_pointer_char, self.code_pointer_line, self.cell_pointer, self.cells[:], historic_output))
-  
     def step_back(self):
-        if len(self.history) < 2:
-            self.code_pointer_char = None
-            self.code_pointer_line = None
-            self.cell_pointer = 0
-            self.cells = []
-            return False, False, None, None, ''
-        finished, remember, char, line, cell_pointer, cells, output = self.history[-2]
-        self.code_pointer_char = char
-        self.code_pointer_line = line
-        self.cell_pointer = cell_pointer
-        self.cells = cells[:]
-
-        _ = self.history.pop()
+        if self.step_count == 0:
+            return False, False, None, ''
+        _, remember, pc, output = self.seek(self.step_count - 1)
         self.last_movement_forward = False
-        return (finished, remember, char, line, output)
+        return False, remember, pc, output
 
     def print_single_line_of_code(self, img, line_number, line_of_code, margin_h, color = (255,255,255)):
         line_height = 36
@@ -170,6 +982,16 @@ class Visualnterpreter:
         for i, line_of_code in enumerate(self.code[-n:]):
             self.print_single_line_of_code(img, i, line_of_code, margin_h)
 
+        # Report unbalanced loops while typing
+        screen = self.pc_to_screen(self.bracket_error)
+        if screen != None:
+            line_number, _, offset = screen
+            first_line = max(len(self.code) - n, 0)
+            if line_number >= first_line:
+                line_height = 36
+                line_margin_v = 8
+                cv2.putText(img, self.program[self.bracket_error], (margin_h + offset, (line_number - first_line) * line_height + (line_height - line_margin_v)), cv2.FONT_HERSHEY_PLAIN, 2, (0,0,255), 2)
+
     def get_text_width(self, text, font_face, font_scale, font_line_thickness):
         ((txt_w, _), _) = cv2.getTextSize(text, font_face, font_scale, font_line_thickness)
         return txt_w
@@ -178,12 +1000,6 @@ class Visualnterpreter:
         ((txt_w, txt_h), _) = cv2.getTextSize(text, font_face, font_scale, font_line_thickness)
         return txt_w, txt_h    
 
-    def draw_black_alpha_box(self, img, x, y, h, w):
-        sub_img = img[y:y+h, x:x+w]
-        black_rect = np.ones(sub_img.shape, dtype=np.uint8) * 0
-        res = cv2.addWeighted(sub_img, 0.3, black_rect, 0.7, 1.0)
-        img[y:y+h, x:x+w] = res
-
     def debug_single_line_of_code(self, img, line_number, line_of_code, margin_h, margin_v, color = (255,255,255)):
         line_height = 36
         line_margin_v = 8
@@ -193,56 +1009,91 @@ class Visualnterpreter:
         if len(self.code) == 0:
             return
         lines = len(self.code)
-        self.draw_black_alpha_box(img, 0, self.INTERPRETER_OFFSET_Y, 40 * lines, img.shape[1])
-        for i, line_of_code in enumerate(self.code):
-            self.debug_single_line_of_code(img, i, line_of_code, margin_h, self.INTERPRETER_OFFSET_Y)
+        box = img[self.INTERPRETER_OFFSET_Y:self.INTERPRETER_OFFSET_Y + 40 * lines]
+        code, shape, layer_margin_h = self.code_layer_key
+        # input_code keeps the same list as long as the code is the same
+        if code is not self.code or shape != box.shape or layer_margin_h != margin_h:
+            self.build_code_layer(box.shape, margin_h)
+        draw_alpha_box(box, 0, 0, box.shape[0], box.shape[1], 0, 0.7)
+        cv2.max(box, self.code_layer, dst=box)
+        for pc in self.breakpoints:
+            self.highlight_debug_command(img, pc, margin_h, (0, 165, 255))
 
-    def highlight_debug_command(self, img, char_number, line_number, margin_h, color = (50, 205, 50)):
-        if char_number == None or line_number == None:
+    def draw_heatmap(self, img, counts, margin_h):
+        # Color each command by how often it was executed, on a log scale from blue to red
+        length = min(len(counts), len(self.program))
+        if length == 0 or counts[:length].max() == 0:
             return
-        if line_number >= len(self.code) or char_number >= len(self.code[line_number]):
+        heat = np.log1p(counts[:length]) / np.log1p(counts[:length].max())
+        colors = cv2.applyColorMap((heat * 255).astype(np.uint8).reshape(-1, 1), cv2.COLORMAP_JET).reshape(-1, 3)
+        for pc in np.flatnonzero(counts[:length]):
+            self.highlight_debug_command(img, int(pc), margin_h, tuple(int(c) for c in colors[pc]))
+
+    def build_code_layer(self, shape, margin_h):
+        layer = np.zeros(shape, np.uint8)
+        for i, line_of_code in enumerate(self.code):
+            self.debug_single_line_of_code(layer, i, line_of_code, margin_h, 0)
+        # White text on black, so the brightest of the two is the text where there is text, and the box elsewhere
+        self.code_layer = layer
+        self.code_layer_key = (self.code, shape, margin_h)
+
+    def highlight_debug_command(self, img, pc, margin_h, color = (50, 205, 50)):
+        screen = self.pc_to_screen(pc)
+        if screen == None:
             return
+        line_number, _, offset = screen
         line_height = 36
         line_margin_v = 8
-        previous_code = self.code[line_number][:char_number]
-        if len(previous_code) > 0:
-            # Subtract 2, beacuse the measurement of an empty string apparently is 2
-            offset = self.get_text_width(previous_code, cv2.FONT_HERSHEY_PLAIN, 2, 2) - 2
-        else:
-            offset = 0
-        command = self.code[line_number][char_number]
+        command = self.program[pc]
         cv2.putText(img, command, (margin_h + offset, self.INTERPRETER_OFFSET_Y + line_number * line_height + (line_height - line_margin_v)), cv2.FONT_HERSHEY_PLAIN, 2, color, 2)
 
-    # Print the first 8 cells
+    # Print 8 cells, scrolled to show the cell pointer, with the cell numbers in the corner
     #                   v
     # +-------------------------------+
+    # |8  |9  |10 |11 |12 |13 |14 |15 |
     # | 0 | 0 | 0 | 0 | 3 | 0 | 0 | 0 | 
     # +-------------------------------+
-    def print_cells(self, img):
-        if self.cell_pointer == None:
+    def print_cells(self, img, snapshot):
+        if snapshot.cell_pointer == None:
             return
 
-        self.draw_black_alpha_box(img, 0, 428, 70, img.shape[1])
+        draw_alpha_box(img, 0, 428, 70, img.shape[1], 0, 0.7)
         
         # Draw cells
-        cv2.line(img, (4, 432), (636, 432), (255,255,255), 2)
-        cv2.line(img, (4, 476), (636, 476), (255,255,255), 2)
-        for i in range(4, 640, 79):
+        right = 4 + 79 * self.view_cells
+        cv2.line(img, (4, 432), (right, 432), (255,255,255), 2)
+        cv2.line(img, (4, 476), (right, 476), (255,255,255), 2)
+        for i in range(4, right + 1, 79):
             cv2.line(img, (i, 432), (i, 476), (255,255,255), 2)
         
-        # Draw cell values
-        for i, cell in enumerate(self.cells[:8]):
-            offset = self.get_text_width(str(cell), cv2.FONT_HERSHEY_PLAIN, 2, 2) - 2
-            cv2.putText(img, str(cell), ((i + 1) * 79 - offset, 465), cv2.FONT_HERSHEY_PLAIN, 2, (255,255,255), 2)
+        # Draw cell numbers and values, from sprites of the 256 possible values
+        for i, cell in enumerate(snapshot.cells[:self.view_cells]):
+            GLYPH_ATLAS.draw_glyphs(img, str(snapshot.cell_offset + i), (i * 79 + 8, 444), cv2.FONT_HERSHEY_PLAIN, 0.8, (160,160,160), 1)
+            offset = GLYPH_ATLAS.text_width(CELL_TEXTS[cell], cv2.FONT_HERSHEY_PLAIN, 2, 2) - 2
+            GLYPH_ATLAS.draw(img, CELL_TEXTS[cell], ((i + 1) * 79 - offset, 465), cv2.FONT_HERSHEY_PLAIN, 2, (255,255,255), 2)
             
         # Draw pointer to current cell (cell pointer)
-        xp = 40 + 79 * self.cell_pointer
+        xp = 40 + 79 * (snapshot.cell_pointer - snapshot.cell_offset)
         yp = 422
         cv2.line(img, (xp, yp), (xp - 20, yp - 15), (255,255,255), 5)
         cv2.line(img, (xp, yp), (xp + 20, yp - 15), (255,255,255), 5)        
         cv2.line(img, (xp, yp), (xp - 20, yp - 15), (0,0,255), 3)
         cv2.line(img, (xp, yp), (xp + 20, yp - 15), (0,0,255), 3)
 
+    # Heatmap of the whole tape, in a strip above the cells, with the cells shown by print_cells outlined
+    def print_tape_heatmap(self, img, snapshot):
+        if snapshot.tape_heat is None or len(snapshot.tape_heat) == 0:
+            return
+        heat = np.frombuffer(snapshot.tape_heat, np.uint8)
+        width = img.shape[1]
+        img[394:404, :width] = HEATMAP_COLORS[heat[np.arange(width) * len(heat) // width]]
+        cells_per_pixel = snapshot.tape_length / width
+        left = int(snapshot.cell_offset / cells_per_pixel)
+        right = max(int((snapshot.cell_offset + self.view_cells) / cells_per_pixel), left + 2)
+        cv2.rectangle(img, (left, 392), (min(right, width - 1), 405), (255,255,255), 1)
+        pointer = int(snapshot.cell_pointer / cells_per_pixel)
+        cv2.line(img, (pointer, 390), (pointer, 407), (0,0,255), 2)
+
     def print_outout(self, img, output, color):
         if len(output) > 0:
             font_size = 5
@@ -261,7 +1112,7 @@ class Visualnterpreter:
 
             if width > 0 and height > 0:
                 # Consider allowing multipe lines of output
-                self.draw_black_alpha_box(img, 0, 320, 70, img.shape[1])      
+                draw_alpha_box(img, 0, 320, 70, img.shape[1], 0, 0.7)
                 # Offset to keep text centered, while getting smaller
                 offset = int((47 - height) / 2)    
                 cv2.putText(img, output, (int((img.shape[1] - width) / 2) , 380 - offset), cv2.FONT_HERSHEY_PLAIN, font_size, color, font_thickness)
@@ -0,0 +1,117 @@
+# Runs a Visualnterpreter on a worker thread, so heavy programs don't steal time from pose detection and drawing
+# The render loop only reads the latest snapshot, and controls the interpreter with messages
+# Changing the code and restarting are done under the lock, because the editor needs the answer right away
+
+from Interpreter import command_heatmap
+import queue
+import threading
+import time
+
+class InterpreterThread:
+    def __init__(self, interpreter, frames_per_second = 30, slice_budget = 0.005):
+        self.interpreter = interpreter
+        # In fast and run mode, hold the lock for short slices only, so the render loop never waits long
+        self.interpreter.frame_budget = slice_budget
+        self.frame_interval = 1 / frames_per_second
+        self.lock = threading.Lock()
+        self.messages = queue.Queue()
+        self.running = False
+        self.requested_running = False
+        self.sent = 0
+        self.handled = 0
+        self.pauses = 0
+        # How often each command ran in the last trace saved
+        self.heatmap = None
+        self.stopping = False
+        self.snapshot = interpreter.snapshot()
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.thread.start()
+
+    def send(self, message, *args):
+        self.sent += 1
+        self.messages.put((message, args))
+
+    def set_running(self, running):
+        if running != self.requested_running:
+            self.requested_running = running
+            self.send('run', running)
+
+    def caught_up(self):
+        # True when the snapshot reflects every message sent
+        return self.handled == self.sent
+
+    def input_code(self, code, line_x = None):
+        with self.lock:
+            self.interpreter.input_code(code, line_x)
+
+    def build_jumpmap(self):
+        with self.lock:
+            return self.interpreter.build_jumpmap()
+
+    def prepare_code(self):
+        with self.lock:
+            result = self.interpreter.prepare_code()
+            self.publish()
+        return result
+
+    def stop(self):
+        self.stopping = True
+        self.thread.join()
+
+    def publish(self):
+        self.snapshot = self.interpreter.snapshot()
+
+    def handle(self, message, args):
+        if message == 'run':
+            self.running = args[0]
+        elif message == 'step':
+            self.interpreter.step(single_step=True)
+        elif message == 'step_back':
+            self.interpreter.step_back()
+        elif message == 'seek_output':
+            self.interpreter.seek_output(args[0])
+        elif message == 'mode':
+            self.interpreter.mode = args[0]
+        elif message == 'breakpoint':
+            self.interpreter.toggle_breakpoint(args[0])
+        elif message == 'tape_heatmap':
+            self.interpreter.tape_heatmap = args[0]
+        elif message == 'start_trace':
+            self.heatmap = None
+            self.interpreter.start_trace()
+        elif message == 'stop_trace':
+            self.interpreter.stop_trace()
+            self.interpreter.save_trace(args[0])
+            self.heatmap = command_heatmap(self.interpreter.trace_pc[:self.interpreter.trace_length], len(self.interpreter.program))
+
+    def work(self):
+        next_frame = time.perf_counter()
+        while not self.stopping:
+            # In watch mode one frame is run per display frame, in the other modes as much as possible
+            busy = self.running and self.interpreter.mode != 'watch'
+            timeout = 0 if busy else min(max(next_frame - time.perf_counter(), 0), self.frame_interval)
+            try:
+                message, args = self.messages.get(timeout=timeout) if timeout > 0 else self.messages.get_nowait()
+                with self.lock:
+                    self.handle(message, args)
+                    self.publish()
+                self.handled += 1
+                continue
+            except queue.Empty:
+                pass
+
+            now = time.perf_counter()
+            frame_due = now >= next_frame
+            if self.running and (busy or frame_due):
+                with self.lock:
+                    finished, _, _, _, should_pause = self.interpreter.run_frame()
+                    if finished or should_pause:
+                        self.running = False
+                        self.pauses += 1
+                        self.publish()
+                # Let the render loop grab the lock between slices
+                time.sleep(0)
+            if frame_due:
+                next_frame = now + self.frame_interval
+                with self.lock:
+                    self.publish()
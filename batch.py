@@ -0,0 +1,67 @@
+# Judge many brainfuck programs at once, headless, spread over a pool of processes
+# Each program runs with the same interpreter as bodyfuck.py, within its own step and time limits
+# Usage: python batch.py submissions/*.b [--word kode24] [--max-steps N] [--time-limit S] [--jobs N] [--json results.json]
+
+import argparse
+from collections import namedtuple
+from functools import partial
+from headless import run_program
+import json
+import multiprocessing
+import sys
+
+# Same as COMPETITION_WORD in bodyfuck.py, which can't be imported without a camera and MediaPipe
+DEFAULT_WORD = 'kode24'
+
+BatchResult = namedtuple('BatchResult', ['output', 'steps', 'seconds', 'finished', 'error_pc', 'peak_tape', 'stuck_loop', 'matches_word'])
+
+def judge(source, word, max_steps, time_limit):
+    result = run_program(source, max_steps, time_limit)
+    return BatchResult(result.output, result.steps, result.seconds, result.finished, result.error_pc, result.tape_length,
+                       result.stuck_loop, result.finished and result.output == word)
+
+def run_batch(sources, word = DEFAULT_WORD, max_steps = None, time_limit = None, processes = None):
+    # Returns a BatchResult per source, in the same order
+    sources = list(sources)
+    if len(sources) == 0:
+        return []
+    job = partial(judge, word=word, max_steps=max_steps, time_limit=time_limit)
+    with multiprocessing.Pool(processes) as pool:
+        return pool.map(job, sources, chunksize=max(1, len(sources) // (4 * (processes or multiprocessing.cpu_count()))))
+
+def main():
+    parser = argparse.ArgumentParser(description='Judge many brainfuck programs with the bodyfuck interpreter.')
+    parser.add_argument('files', nargs='+', help='brainfuck source files')
+    parser.add_argument('--word', default=DEFAULT_WORD, help='the output a program must print')
+    parser.add_argument('--max-steps', type=int, help='stop each program after this many steps')
+    parser.add_argument('--time-limit', type=float, help='stop each program after this many seconds')
+    parser.add_argument('--jobs', type=int, help='number of processes, all cores by default')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    sources = []
+    for path in args.files:
+        with open(path, 'r') as f:
+            sources.append(f.read())
+    results = run_batch(sources, args.word, args.max_steps, args.time_limit, args.jobs)
+
+    print(f"{'program':<30}{'ok':>4}{'steps':>12}{'tape':>8}{'seconds':>10}  output")
+    for path, result in zip(args.files, results):
+        if result.error_pc is not None:
+            status = f'unbalanced loop at command {result.error_pc}'
+        elif result.stuck_loop is not None:
+            status = f'endless loop from command {result.stuck_loop[0]} to {result.stuck_loop[1]}'
+        elif not result.finished:
+            status = 'stopped before the end'
+        else:
+            status = repr(result.output[:40]) + ('...' if len(result.output) > 40 else '')
+        print(f"{path:<30}{'yes' if result.matches_word else 'no':>4}{result.steps:>12}{result.peak_tape:>8}{result.seconds:>10.3f}  {status}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump([dict(result._asdict(), file=path) for path, result in zip(args.files, results)], f, indent=2)
+
+    sys.exit(0 if all(result.matches_word for result in results) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# Check that running with the compiled instructions (fast and run mode, headless) ends in exactly the same state as
+# running one command at a time (watch mode), for the workloads in this folder and some loops that are easy to get wrong
+# Usage: python benchmarks/check_modes.py [--max-steps N]
+
+import argparse
+import glob
+import os
+import sys
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from Interpreter import Visualnterpreter
+
+EDGE_CASES = {
+    # Loop bodies that walk left of cell 0, where < is clamped, or past the cells they change
+    'clamped_left': '+[<>-]>-',
+    'clamped_left_twice': '+[<<>>-]',
+    'walk_right': '+[>>><<<-]',
+    'multiply': '++++[>+++<-]>[<++>-]',
+    'clear': '+++[-]>++[+]',
+}
+
+def final_state(source, max_steps, single_step):
+    interpreter = Visualnterpreter()
+    interpreter.keep_history = False
+    # Single steps see every ] jump back, compiled loops don't, so the watchdog could stop them at different steps
+    interpreter.watchdog = False
+    interpreter.input_code(source.splitlines())
+    ok, error_pc = interpreter.prepare_code()
+    if not ok:
+        return ('unbalanced', error_pc)
+    if single_step:
+        while interpreter.step_count < max_steps and interpreter.pc < len(interpreter.program):
+            if interpreter.execute(1)[0] == 0:
+                break
+    else:
+        interpreter.run(max_steps)
+    return (interpreter.step_count, interpreter.pc, interpreter.cell_pointer, interpreter.tape_length,
+            bytes(interpreter.tape_view()), ''.join(interpreter.output))
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare single stepping with the compiled instructions.')
+    parser.add_argument('--max-steps', type=int, default=200000, help='stop each program after this many steps')
+    args = parser.parse_args()
+
+    programs = dict(EDGE_CASES)
+    for path in sorted(glob.glob(os.path.join(BENCHMARK_DIR, '*.b'))):
+        with open(path, 'r') as f:
+            programs[os.path.splitext(os.path.basename(path))[0]] = f.read()
+
+    failed = 0
+    for name, source in programs.items():
+        stepped = final_state(source, args.max_steps, True)
+        compiled = final_state(source, args.max_steps, False)
+        if stepped == compiled:
+            print(f'{name:<20} ok')
+        else:
+            failed += 1
+            print(f'{name:<20} DIFFERENT')
+            print(f'    single steps: steps {stepped[0]}, pointer {stepped[2]}, tape length {stepped[3]}')
+            print(f'    compiled:     steps {compiled[0]}, pointer {compiled[2]}, tape length {compiled[3]}')
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
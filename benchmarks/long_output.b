@@ -0,0 +1,2 @@
+Long output: one hundred times all the byte values from 1 to 255
+++++++++++[>++++++++++<-]>[>+[.+]<-]
@@ -0,0 +1,5 @@
+Nested loop stress: prints ZYXWVUTSRQPONMLKJIHGFEDCBA and a newline
+For each letter four nested loops count down from ten around an innermost clear loop
+>++[<+++++++++++++>-]<[[>+>+<<-]>[<+>-]++++++++[>++++++++<-]>.[-]<<
+>++++++++++[>++++++++++[>++++++++++[>++++++++++[>++++++++++[-]<-]<-]<-]<-]<-]
+++++++++++.
@@ -0,0 +1,89 @@
+# Compare the pose detector in IMAGE mode, which looks for the person in every frame, with VIDEO mode, which tracks the
+# pose from frame to frame, on a recorded clip. Needs MediaPipe and the pose model, but no camera.
+# Usage: python benchmarks/pose_modes.py clip.mp4 [--frames N] [--json results.json]
+
+import argparse
+import json
+import os
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from bodyfuck import PoseDetector
+import cv2
+from mediapipe.tasks.python import vision as mp_vision
+import numpy as np
+from run_benchmarks import current_commit
+
+MODES = {
+    'image': mp_vision.RunningMode.IMAGE,
+    'video': mp_vision.RunningMode.VIDEO,
+}
+
+def read_clip(path, max_frames = None):
+    # Returns the frames mirrored like bodyfuck.py shows them, and the time of each frame in milliseconds
+    cap = cv2.VideoCapture(path)
+    frames, timestamps = [], []
+    while cap.isOpened() and (max_frames is None or len(frames) < max_frames):
+        ready, frame = cap.read()
+        if not ready:
+            break
+        frames.append(cv2.flip(frame, 1))
+        timestamps.append(cap.get(cv2.CAP_PROP_POS_MSEC))
+    cap.release()
+    return frames, timestamps
+
+def run_mode(running_mode, frames, timestamps):
+    # Returns the seconds spent detecting, and the pixel positions found in each frame, None where nobody was found
+    detector = PoseDetector(running_mode=running_mode)
+    positions = []
+    seconds = 0.0
+    for frame, timestamp_ms in zip(frames, timestamps):
+        start = time.perf_counter()
+        detector.process(frame, draw=False, timestamp_ms=timestamp_ms)
+        seconds += time.perf_counter() - start
+        landmarks = detector.find_pixel_positions(frame)
+        positions.append(landmarks[:, :2].copy() if len(landmarks) else None)
+    detector.close()
+    return seconds, positions
+
+def mean_distance(positions, reference):
+    # Mean distance in pixels between the landmarks of two runs, over the frames where both found a pose
+    distances = [np.linalg.norm(a - b, axis=1).mean() for a, b in zip(positions, reference) if a is not None and b is not None]
+    return float(np.mean(distances)) if distances else None
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the pose detector running modes on a recorded clip.')
+    parser.add_argument('clip', help='video file, recorded with the webcam used for bodyfuck')
+    parser.add_argument('--frames', type=int, help='only use this many frames from the start of the clip')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    frames, timestamps = read_clip(args.clip, args.frames)
+    if len(frames) == 0:
+        print(f'No frames in {args.clip}', file=sys.stderr)
+        sys.exit(1)
+
+    results = []
+    reference = None
+    print(f"{'mode':<10}{'frames':>8}{'found':>8}{'seconds':>10}{'ms/frame':>10}{'fps':>8}{'px off':>8}")
+    for name, running_mode in MODES.items():
+        seconds, positions = run_mode(running_mode, frames, timestamps)
+        if reference is None:
+            reference = positions
+        found = sum(position is not None for position in positions)
+        # How far the landmarks are from the ones found in IMAGE mode
+        distance = mean_distance(positions, reference)
+        fps = len(frames) / seconds if seconds > 0 else 0
+        print(f"{name:<10}{len(frames):>8}{found:>8}{seconds:>10.3f}{1000 * seconds / len(frames):>10.1f}{fps:>8.1f}"
+              f"{'-' if distance is None else f'{distance:.1f}':>8}")
+        results.append({'mode': name, 'frames': len(frames), 'found': found, 'seconds': seconds, 'fps': fps, 'pixels_off': distance})
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'commit': current_commit(), 'clip': args.clip, 'results': results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+# Measure interpreter throughput on the classic workloads in this folder, no camera needed
+# Usage: python benchmarks/run_benchmarks.py [--repeat 5] [--json results.json]
+
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from headless import run_program
+
+def current_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARK_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the bodyfuck interpreter.')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per workload, the best time is reported')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'workload':<20}{'steps':>12}{'output':>10}{'best s':>10}{'steps/s':>14}")
+    for path in sorted(glob.glob(os.path.join(BENCHMARK_DIR, '*.b'))):
+        with open(path, 'r') as f:
+            source = f.read()
+        runs = [run_program(source) for _ in range(args.repeat)]
+        best = min(run.seconds for run in runs)
+        steps = runs[0].steps
+        name = os.path.splitext(os.path.basename(path))[0]
+        steps_per_second = steps / best if best > 0 else 0
+        print(f"{name:<20}{steps:>12}{len(runs[0].output):>10}{best:>10.3f}{steps_per_second:>14,.0f}")
+        results.append({'workload': name, 'steps': steps, 'output_length': len(runs[0].output), 'seconds': best, 'steps_per_second': steps_per_second})
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'commit': current_commit(), 'results': results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,16 @@
-from Interpreter import Visualnterpreter
-from DrawUtils import SpeechBubble
+from Interpreter import CELL_TEXTS, MODES, Visualnterpreter
+from InterpreterThread import InterpreterThread
+from CaptureThread import CaptureThread
+from CodeLayout import CodeLayout
+from DrawUtils import GLYPH_ATLAS, SpeechBubble, draw_alpha_box
 import cv2
+from collections import namedtuple
 import datetime
 import json
 import math
 import mediapipe as mp
 import os
+import time
 from mediapipe.tasks import python as mp_tasks
 from mediapipe.tasks.python import vision as mp_vision
 from mediapipe.tasks.python.components.containers import NormalizedLandmark
@@ -48,7 +53,12 @@ load_offsets()
 
 COMPETITION_MODE = False
 COMPETITION_WORD = 'kode24'
+STEP_LIMIT = None # Pause programs after this many steps, None for no limit
 CAMERA_INDEX = 0
+# LIVE_STREAM runs the pose model on MediaPipe's own thread, while the last frame is drawn, and tracks the pose between
+# frames. VIDEO also tracks, but waits for every frame. IMAGE looks for the person again in every frame.
+# Compare them with benchmarks/pose_modes.py
+POSE_RUNNING_MODE = mp_vision.RunningMode.LIVE_STREAM
 
 _MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'annotator', 'pose_landmarker.task')
 
@@ -67,25 +77,112 @@ _FACE_LANDMARK_INDICES = {
 }
 PoseLandmark = mp_vision.PoseLandmark
 
+# Columns of the landmark array, pixel positions and MediaPipe's z and visibility
+X, Y, Z, VISIBILITY = range(4)
+NO_LANDMARKS = np.zeros((0, 4), np.float32)
+
+# The joints whose angles the gestures use, as (end, joint, end)
+# Remember that right and left are mirrored, because the image is flipped
+_ANGLE_JOINTS = np.array([
+    [PoseLandmark.LEFT_SHOULDER, PoseLandmark.LEFT_ELBOW, PoseLandmark.LEFT_WRIST],     # elbow_l
+    [PoseLandmark.RIGHT_SHOULDER, PoseLandmark.RIGHT_ELBOW, PoseLandmark.RIGHT_WRIST],  # elbow_r
+    [PoseLandmark.RIGHT_HIP, PoseLandmark.RIGHT_SHOULDER, PoseLandmark.RIGHT_ELBOW],    # shoulder_l
+    [PoseLandmark.LEFT_HIP, PoseLandmark.LEFT_SHOULDER, PoseLandmark.LEFT_ELBOW],       # shoulder_r
+])
+_UPPER_ARMS = np.array([
+    [PoseLandmark.LEFT_SHOULDER, PoseLandmark.LEFT_ELBOW],
+    [PoseLandmark.RIGHT_SHOULDER, PoseLandmark.RIGHT_ELBOW],
+])
+
+PoseFeatures = namedtuple('PoseFeatures', ['elbow_l', 'elbow_r', 'shoulder_l', 'shoulder_r', 'upper_arm_l', 'upper_arm_r',
+                                           'upper_arm', 'half_upper_arm', 'left_arm_horizontal', 'right_arm_horizontal',
+                                           'left_wrist_up', 'right_wrist_up', 'facepalm'])
+
+def joint_angles(landmarks, joints):
+    # Angle in degrees, between 0 and 180, at the middle landmark of each row of joints
+    ends_a = landmarks[joints[:, 0], :2] - landmarks[joints[:, 1], :2]
+    ends_b = landmarks[joints[:, 2], :2] - landmarks[joints[:, 1], :2]
+    angles = np.degrees(np.arctan2(ends_b[:, 1], ends_b[:, 0]) - np.arctan2(ends_a[:, 1], ends_a[:, 0]))
+    angles[angles < 0] += 360
+    return np.where(angles > 180, 360 - angles, angles)
+
+def pose_features(landmarks):
+    # Everything the gestures measure on the body, computed together once per frame
+    elbow_l, elbow_r, shoulder_l, shoulder_r = joint_angles(landmarks, _ANGLE_JOINTS).tolist()
+    upper_arms = landmarks[_UPPER_ARMS[:, 1], :2] - landmarks[_UPPER_ARMS[:, 0], :2]
+    upper_arm_l, upper_arm_r = np.hypot(upper_arms[:, 0], upper_arms[:, 1]).tolist()
+    half_upper_arm = int((upper_arm_l + upper_arm_r) / 4)
+    upper_arm = int((upper_arm_l + upper_arm_r) / 2)
+
+    # Arms horizontal, less then half an upper arm off
+    shoulders_y = landmarks[[PoseLandmark.LEFT_SHOULDER, PoseLandmark.RIGHT_SHOULDER], Y]
+    wrists_y = landmarks[[PoseLandmark.LEFT_WRIST, PoseLandmark.RIGHT_WRIST], Y]
+    left_arm_horizontal, right_arm_horizontal = (np.abs(shoulders_y - wrists_y) < half_upper_arm).tolist()
+    # Wrists more than an upper arm above the nose
+    nose_y = landmarks[PoseLandmark.NOSE, Y]
+    left_wrist_up, right_wrist_up = (wrists_y < nose_y - upper_arm).tolist()
+    # Index finger horizontally between the outer eyes, above the nose, not too far above head
+    index_x, index_y = landmarks[PoseLandmark.LEFT_INDEX, :2]
+    facepalm = bool(landmarks[PoseLandmark.RIGHT_EYE_OUTER, X] < index_x < landmarks[PoseLandmark.LEFT_EYE_OUTER, X]
+                    and nose_y - half_upper_arm < index_y < nose_y)
+
+    return PoseFeatures(elbow_l, elbow_r, shoulder_l, shoulder_r, upper_arm_l, upper_arm_r, upper_arm, half_upper_arm,
+                        left_arm_horizontal, right_arm_horizontal, left_wrist_up, right_wrist_up, facepalm)
+
 class PoseDetector():
-    def __init__(self, detectionCon=0.5, trackCon=0.5):
+    def __init__(self, detectionCon=0.5, trackCon=0.5, running_mode=mp_vision.RunningMode.IMAGE):
+        self.running_mode = running_mode
+        live_stream = running_mode == mp_vision.RunningMode.LIVE_STREAM
         options = mp_vision.PoseLandmarkerOptions(
             base_options=mp_tasks.BaseOptions(model_asset_path=_MODEL_PATH),
-            running_mode=mp_vision.RunningMode.IMAGE,
+            running_mode=running_mode,
             num_poses=1,
             min_pose_detection_confidence=detectionCon,
             min_tracking_confidence=trackCon,
+            result_callback=self._on_result if live_stream else None,
         )
         self.pose = mp_vision.PoseLandmarker.create_from_options(options)
         self._connections = mp_vision.PoseLandmarksConnections.POSE_LANDMARKS
         self.detection_result = None
+        self.landmarks = NO_LANDMARKS
+        # Reused for the RGB copy of every frame. mp.Image copies it, so it may change while a frame is detected.
+        self.rgb_frame = None
+        # Timestamp in milliseconds of the frame detection_result was found in
+        self.result_timestamp_ms = None
+        self.last_timestamp_ms = -1
+        # Set by the callback, from MediaPipe's thread. Replaced as a whole, so it is never read half written.
+        self.latest_result = (None, None)
+
+    def _on_result(self, result, output_image, timestamp_ms):
+        self.latest_result = (result, timestamp_ms)
+
+    def next_timestamp_ms(self, timestamp_ms=None):
+        # MediaPipe needs the timestamps of a stream to be strictly increasing
+        if timestamp_ms is None:
+            timestamp_ms = time.monotonic_ns() // 1000000
+        self.last_timestamp_ms = max(int(timestamp_ms), self.last_timestamp_ms + 1)
+        return self.last_timestamp_ms
+
+    def process(self, img, draw=True, timestamp_ms=None):
+        # timestamp_ms is when the frame was captured, the monotonic clock when left out. Use the position in a
+        # recorded video, to track the pose the same way however fast the video is processed.
+        # cvtColor always writes a contiguous array, the only copy MediaPipe makes is its own
+        self.rgb_frame = cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=self.rgb_frame)
+        mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=self.rgb_frame)
+        if self.running_mode == mp_vision.RunningMode.LIVE_STREAM:
+            # Returns at once, and the result arrives at _on_result later. Until then use the most recent result,
+            # from an earlier frame. Frames sent while the model is busy are dropped by MediaPipe.
+            self.pose.detect_async(mp_image, self.next_timestamp_ms(timestamp_ms))
+            self.detection_result, self.result_timestamp_ms = self.latest_result
+        elif self.running_mode == mp_vision.RunningMode.VIDEO:
+            # Tracks the pose from the previous frame, and only looks for the person again when tracking is lost
+            self.result_timestamp_ms = self.next_timestamp_ms(timestamp_ms)
+            self.detection_result = self.pose.detect_for_video(mp_image, self.result_timestamp_ms)
+        else:
+            self.detection_result = self.pose.detect(mp_image)
+            self.result_timestamp_ms = self.next_timestamp_ms(timestamp_ms)
 
-    def process(self, img, draw=True):
-        imgRGB = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=np.ascontiguousarray(imgRGB))
-        self.detection_result = self.pose.detect(mp_image)
-
-        if self.detection_result.pose_landmarks and draw:
+        if self.detection_result and self.detection_result.pose_landmarks and draw:
             pose_landmarks = self.detection_result.pose_landmarks[0]
             # Hide face landmarks by zeroing visibility
             filtered = [
@@ -97,21 +194,25 @@ class PoseDetector():
 
         return img
 
+    def close(self):
+        self.pose.close()
+
     def find_pixel_positions(self, img):
-        self.landmark_list = []
+        # A (33, 4) float32 array of x and y in whole pixels, z and visibility, or no rows when nobody was found
+        self.landmarks = NO_LANDMARKS
         if self.detection_result and self.detection_result.pose_landmarks:
             pose_landmarks = self.detection_result.pose_landmarks[0]
+            self.landmarks = np.array([(lm.x, lm.y, lm.z or 0.0, lm.visibility or 0.0) for lm in pose_landmarks], np.float32)
             # Determining the pixel position of the landmarks
             h, w, _ = img.shape
-            for id, lm in enumerate(pose_landmarks):
-                cx, cy = int(lm.x * w), int(lm.y * h)
-                self.landmark_list.append([id, cx, cy])
-        return self.landmark_list
+            self.landmarks[:, :2] *= (w, h)
+            np.trunc(self.landmarks[:, :2], out=self.landmarks[:, :2])
+        return self.landmarks
 
     def find_angle(self, p1, p2, p3):
-        x1, y1 = self.landmark_list[p1][1:]
-        x2, y2 = self.landmark_list[p2][1:]
-        x3, y3 = self.landmark_list[p3][1:]
+        x1, y1 = self.landmarks[p1, :2].tolist()
+        x2, y2 = self.landmarks[p2, :2].tolist()
+        x3, y3 = self.landmarks[p3, :2].tolist()
 
         angle = math.degrees(math.atan2(y3-y2, x3-x2) - math.atan2(y1-y2, x1-x2))
         if angle < 0:
@@ -124,33 +225,21 @@ class PoseDetector():
         return angle
 
     def find_length(self, p1, p2):
-        x1, y1 = self.landmark_list[p1][1:]
-        x2, y2 = self.landmark_list[p2][1:]
+        x1, y1 = self.landmarks[p1, :2].tolist()
+        x2, y2 = self.landmarks[p2, :2].tolist()
         distance = math.sqrt((x2 - x1)**2 + (y2 - y1)**2)
         return distance  
 
-def get_text_width(text, font_face, font_scale, font_line_thickness):
-    ((txt_w, _), _) = cv2.getTextSize(text, font_face, font_scale, font_line_thickness)
-    return txt_w
-
-def draw_white_apha_box(img, x, y, h, w):
-    # Crop the sub-rect from the image
-    # https://stackoverflow.com/questions/56472024/how-to-change-the-opacity-of-boxes-cv2-rectangle
-    sub_img = img[y:y+h, x:x+w]
-    white_rect = np.ones(sub_img.shape, dtype=np.uint8) * 255
-    res = cv2.addWeighted(sub_img, 0.5, white_rect, 0.5, 1.0)
-
-    # Put the image back to its position
-    img[y:y+h, x:x+w] = res
-
 def main():
     global CAMERA_INDEX
     global SHOW_GRID_LINES
 
-    detector = PoseDetector()
+    detector = PoseDetector(running_mode=POSE_RUNNING_MODE)
     cap = cv2.VideoCapture(CAMERA_INDEX)
     cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
     cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+    # The camera is read on its own thread, the loop below gets the newest frame
+    capture_thread = CaptureThread(cap)
 
     show_code_lines = True
     SHOW_GRID_LINES = False
@@ -159,6 +248,8 @@ def main():
     same_command_count = 0
     code = ''
     lines_of_code = []
+    code_x = []
+    code_layout = CodeLayout(MIN_CHARS_PER_LINE)
 
     clap_count = 0
     clap_stage = ''
@@ -169,6 +260,9 @@ def main():
 
     print_lock = 0
     pause = False
+    # Every frame is mirrored into the same buffer, and drawn on there
+    frame = None
+    pose_timestamp_ms = None
     execute_code = False
     reload_code = False
     code_output = ''
@@ -176,12 +270,24 @@ def main():
     interpreter_paused = False
     interpreter_stopped = False
     interpreter_error = False
-    interpreter_error_line = 0
-    interpreter_error_char = 0
+    interpreter_error_pc = None
+    pc = None
     step_forward = False
     step_back = False
     interpreter = Visualnterpreter()
+    interpreter.step_limit = STEP_LIMIT
+    interpreter_thread = InterpreterThread(interpreter)
+    interpreter_pauses = 0
+    interpreter_mode = MODES[0]
+    tracing = False
+    show_tape_heatmap = False
     speech_bubble = SpeechBubble()
+    # The gesture feedback and the claps are blended from sprites rendered once
+    GLYPH_ATLAS.prepare('+-<>.', cv2.FONT_HERSHEY_PLAIN, FONT_SIZE, (0,0,255), FONT_WEIGHT)
+    GLYPH_ATLAS.prepare('[]', cv2.FONT_HERSHEY_PLAIN, FONT_SIZE - 5, (0,0,255), FONT_WEIGHT)
+    GLYPH_ATLAS.prepare(['Clap!', 'Clap! Clap!'], cv2.FONT_HERSHEY_PLAIN, 4, (0,0,255), FONT_WEIGHT)
+    GLYPH_ATLAS.prepare(CELL_TEXTS, cv2.FONT_HERSHEY_PLAIN, 2, (255,255,255), 2)
+    GLYPH_ATLAS.prepare('0123456789', cv2.FONT_HERSHEY_PLAIN, 0.8, (160,160,160), 1)
 
     nova_start_time = None
     nova_end_time = None
@@ -195,18 +301,28 @@ def main():
     print('        c: Toggle code view')
     print('        g: Toggle grid')
     print('        p: Pause')
+    print('        f: Switch interpreter mode: watch, fast, run to output')
+    print('        k: Toggle breakpoint at the highlighted command')
+    print('        n: Jump to next output, when paused')
+    print('        b: Jump back to previous output, when paused')
+    print('        t: Start/stop recording a trace, shown as a heatmap when stopped')
+    print('        h: Toggle heatmap of the whole tape')
     print('backspace: Delete single character')
     print('   delete: Clear code')
     print('      F11: Toggle fullscreen')
     print(' ')
 
-    while cap.isOpened():
-        ready, flipped_frame = cap.read()
+    while capture_thread.is_opened():
+        ready, flipped_frame = capture_thread.read()
 
         if ready:    
-            frame = cv2.flip(flipped_frame, 1)
+            frame = cv2.flip(flipped_frame, 1, dst=frame)
             annotated_frame = detector.process(frame, draw=not pause)
             landmarks = detector.find_pixel_positions(frame)
+            # The gesture timers count new poses, not frames. With the live stream, several frames can show the
+            # same pose, found in an earlier frame.
+            pose_step = 1 if detector.result_timestamp_ms != pose_timestamp_ms else 0
+            pose_timestamp_ms = detector.result_timestamp_ms
 
             h, w, _ = frame.shape
             THRESHOLD_LEFT_X = 640 - THRESHOLD_EDGE
@@ -218,38 +334,38 @@ def main():
                 cv2.line(frame, (0, THRESHOLD_DUCK_Y), (w, THRESHOLD_DUCK_Y), (111,111,111), 2)
             # w = 640
             # h = 480
+            # The interpreter runs on its own thread, here we only send it messages and draw its latest snapshot
+            interpreter_thread.set_running(execute_code and not interpreter_paused and not interpreter_stopped and not interpreter_finished_debug_and_print and not pause)
             if execute_code:
-                finished = False
                 interpreter.debug_lines_of_code(frame, (int(HORIZONTAL_MARGIN / 2)))
-                if not interpreter_paused and not interpreter_stopped and not interpreter_finished_debug_and_print and not pause or (interpreter_paused and (step_forward or step_back)):
-                    complete_outout = None
-                    if interpreter_paused:
-                        if step_forward:
-                            step_forward = False
-                            finished, remember, c, l, o = interpreter.step(single_step=True)
-                        if step_back:
-                            step_back = False
-                            interpreter_finished_debug_and_print = False
-                            finished, remember, c, l, complete_outout = interpreter.step_back()
-                    else:
-                        finished, remember, c, l, o = interpreter.step()
-                    if o:
-                        code_output += o
-
-                    if complete_outout != None:
-                        code_output = complete_outout
-                        
-                    if remember:
-                        interpreter.history_append(code_output)
-
-                    if finished:
-                        # When resuming interpreting after stepping, make sure we not start from beginning after finishing
-                        clap_count = 0
-                            
-                    if finished and not interpreter_finished_debug_and_print:
-                        interpreter_finished_debug_and_print = True
-                        interpreter_paused = True
-                interpreter.print_cells(frame)
+                if interpreter_thread.heatmap is not None:
+                    interpreter.draw_heatmap(frame, interpreter_thread.heatmap, (int(HORIZONTAL_MARGIN / 2)))
+                if interpreter_paused:
+                    if step_forward:
+                        step_forward = False
+                        interpreter_thread.send('step')
+                    if step_back:
+                        step_back = False
+                        interpreter_finished_debug_and_print = False
+                        interpreter_thread.send('step_back')
+
+                # Paused by a breakpoint, an output in run mode, the watchdog, or the end of the program
+                if interpreter_thread.pauses != interpreter_pauses:
+                    interpreter_pauses = interpreter_thread.pauses
+                    interpreter_paused = True
+
+                snapshot = interpreter_thread.snapshot
+                finished = snapshot.finished
+                pc = snapshot.last_pc
+                code_output = snapshot.output
+
+                if finished and not interpreter_finished_debug_and_print and interpreter_thread.caught_up():
+                    # When resuming interpreting after stepping, make sure we not start from beginning after finishing
+                    clap_count = 0
+                    interpreter_finished_debug_and_print = True
+                    interpreter_paused = True
+                interpreter.print_cells(frame, snapshot)
+                interpreter.print_tape_heatmap(frame, snapshot)
                 if code_output == COMPETITION_WORD or COMPETITION_MODE == False:
                     interpreter.print_outout(frame, code_output, (0,255,0))
                 else:
@@ -259,36 +375,22 @@ def main():
                         interpreter.print_outout(frame, code_output, (255,255,255))
 
                 if interpreter_error:
-                    interpreter.highlight_debug_command(frame, interpreter_error_char, interpreter_error_line, (int(HORIZONTAL_MARGIN / 2)), (0, 0, 255))
+                    interpreter.highlight_debug_command(frame, interpreter_error_pc, (int(HORIZONTAL_MARGIN / 2)), (0, 0, 255))
                 elif pause or (not finished and not interpreter_stopped and not interpreter_finished_debug_and_print):
-                    interpreter.highlight_debug_command(frame, c, l, (int(HORIZONTAL_MARGIN / 2)))                        
+                    interpreter.highlight_debug_command(frame, pc, (int(HORIZONTAL_MARGIN / 2)))                        
+                if snapshot.stuck_loop is not None:
+                    # The watchdog found a loop that never ends
+                    for loop_pc in snapshot.stuck_loop:
+                        interpreter.highlight_debug_command(frame, loop_pc, (int(HORIZONTAL_MARGIN / 2)), (0, 0, 255))
 
             if show_code_lines:
-                lines_of_code = []
-                code_left_to_print = code.strip()
-                while len(code_left_to_print) > 0:
-                    if len(code_left_to_print) > MIN_CHARS_PER_LINE:
-                        char_count = MIN_CHARS_PER_LINE
-                        line_width = get_text_width(code_left_to_print[:char_count], cv2.FONT_HERSHEY_PLAIN, 2, 2)
-                        while line_width < w - HORIZONTAL_MARGIN and char_count < len(code_left_to_print):
-                            char_count += 1
-                            line_width = get_text_width(code_left_to_print[:char_count], cv2.FONT_HERSHEY_PLAIN, 2, 2)
-                        if line_width > w - HORIZONTAL_MARGIN:
-                            char_count -= 1
-                        if char_count > len(code_left_to_print):
-                            char_count = len(code_left_to_print)
-                        lines_of_code.append(code_left_to_print[:char_count].strip()) 
-                        code_left_to_print = code_left_to_print[char_count:]
-                    else:
-                        lines_of_code.append(code_left_to_print.strip())
-                        code_left_to_print = ''
-
-                interpreter.input_code(lines_of_code)
+                lines_of_code, code_x = code_layout.wrap(code, w - HORIZONTAL_MARGIN)
+                interpreter_thread.input_code(lines_of_code, code_x)
 
                 # If code is updated with [ or ] while running, we need to update jump map
                 if reload_code:
                     reload_code = False                     
-                    ok, (interpreter_error_line, interpreter_error_char) = interpreter.build_jumpmap()
+                    ok, interpreter_error_pc = interpreter_thread.build_jumpmap()
                     if ok:
                         interpreter_error = False
                     interpreter_paused = not ok
@@ -299,57 +401,53 @@ def main():
                     interpreter.print_lines_of_code(frame, MAX_LINES_OF_CODE, (int(HORIZONTAL_MARGIN / 2)))
 
             if len(landmarks) and not pause:
-                elbow_l = detector.find_angle(PoseLandmark.LEFT_SHOULDER, PoseLandmark.LEFT_ELBOW, PoseLandmark.LEFT_WRIST)
-                elbow_r = detector.find_angle(PoseLandmark.RIGHT_SHOULDER, PoseLandmark.RIGHT_ELBOW, PoseLandmark.RIGHT_WRIST)
-                upper_arm_l = detector.find_length(PoseLandmark.LEFT_SHOULDER, PoseLandmark.LEFT_ELBOW)
-                upper_arm_r = detector.find_length(PoseLandmark.RIGHT_SHOULDER, PoseLandmark.RIGHT_ELBOW)
-                half_upper_arm = int((upper_arm_l + upper_arm_r) / 4)
-                upper_arm = int((upper_arm_l + upper_arm_r) / 2)
+                features = pose_features(landmarks)
+                half_upper_arm = features.half_upper_arm
 
                 # Elbow positions
-                elbow_left_straight = elbow_l > 130
-                elbow_right_straight = elbow_r > 130
+                elbow_left_straight = features.elbow_l > 130
+                elbow_right_straight = features.elbow_r > 130
                 elbows_straight = elbow_left_straight and elbow_right_straight
                 # Arms horizontal, less then half an upper arm off
-                left_arm_horizonal = abs(landmarks[PoseLandmark.LEFT_SHOULDER][2] - landmarks[PoseLandmark.LEFT_WRIST][2]) < half_upper_arm
-                right_arm_horizonal = abs(landmarks[PoseLandmark.RIGHT_SHOULDER][2] - landmarks[PoseLandmark.RIGHT_WRIST][2]) < half_upper_arm
+                left_arm_horizonal = features.left_arm_horizontal
+                right_arm_horizonal = features.right_arm_horizontal
 
                 # Arms out, printing
                 if elbows_straight and left_arm_horizonal and right_arm_horizonal:
                     if last_command == '.':
-                        same_command_count += 1
+                        same_command_count += pose_step
                     elif print_lock == 0: # Avoid triggering double .
                         print_lock = 1
                         last_command = '.'
                         code += last_command
                         same_command_count = 0
                     if same_command_count > COMMAND_DELAY:
-                        draw_white_apha_box(frame, 260, 95, 110, 120)
+                        draw_alpha_box(frame, 260, 95, 110, 120, 255, 0.5)
                         # Print . a litle higher than other commands
-                        cv2.putText(frame, '.', (280+15, 200-30), cv2.FONT_HERSHEY_PLAIN, FONT_SIZE, (0,0,255), FONT_WEIGHT)
+                        GLYPH_ATLAS.draw(frame, '.', (280+15, 200-30), cv2.FONT_HERSHEY_PLAIN, FONT_SIZE, (0,0,255), FONT_WEIGHT)
 
                 # Stepping debugger forward/back
                 elif interpreter_paused and ((elbow_left_straight and left_arm_horizonal) or (elbow_right_straight and right_arm_horizonal)):
                     # Remberer that left and right are mirrored
                     if elbow_left_straight and left_arm_horizonal and not (elbow_right_straight and right_arm_horizonal):
                         if last_command == '-->':
-                            same_command_count += 1
+                            same_command_count += pose_step
                         elif (last_command == 'default' or last_command == ''):
                             last_command = '-->'
                             same_command_count = 0
                             step_forward = True
                     elif elbow_right_straight and right_arm_horizonal and not (elbow_left_straight and left_arm_horizonal):
                         if last_command == '<--':
-                            same_command_count += 1
+                            same_command_count += pose_step
                         elif (last_command == 'default' or last_command == ''):
                             last_command = '<--'
                             same_command_count = 0
                             step_back = True
 
                 # Double-up, not included in original spec
-                elif landmarks[PoseLandmark.LEFT_WRIST][2] < landmarks[PoseLandmark.NOSE][2] - upper_arm and landmarks[PoseLandmark.RIGHT_WRIST][2] < landmarks[PoseLandmark.NOSE][2] - upper_arm: 
+                elif features.left_wrist_up and features.right_wrist_up:
                     if last_command == '++':
-                        same_command_count += 1
+                        same_command_count += pose_step
                     elif last_command == '+': # Upgrading directly from + to ++, should yield a total of ++ not +++
                         last_command = '++'
                         if code.endswith('+++++'):
@@ -366,16 +464,16 @@ def main():
                             code += last_command
                         same_command_count = 0
                     if same_command_count > COMMAND_DELAY:
-                        draw_white_apha_box(frame, 145, 95, 110, 355)
-                        cv2.putText(frame, '+', (140, 200), cv2.FONT_HERSHEY_PLAIN, FONT_SIZE, (0,0,255), FONT_WEIGHT)
-                        cv2.putText(frame, '+', (380, 200), cv2.FONT_HERSHEY_PLAIN, FONT_SIZE, (0,0,255), FONT_WEIGHT)                                
+                        draw_alpha_box(frame, 145, 95, 110, 355, 255, 0.5)
+                        GLYPH_ATLAS.draw(frame, '+', (140, 200), cv2.FONT_HERSHEY_PLAIN, FONT_SIZE, (0,0,255), FONT_WEIGHT)
+                        GLYPH_ATLAS.draw(frame, '+', (380, 200), cv2.FONT_HERSHEY_PLAIN, FONT_SIZE, (0,0,255), FONT_WEIGHT)                                
                
                 # Hands up!
-                elif landmarks[PoseLandmark.LEFT_WRIST][2] < landmarks[PoseLandmark.NOSE][2] - upper_arm or landmarks[PoseLandmark.RIGHT_WRIST][2] < landmarks[PoseLandmark.NOSE][2] - upper_arm : 
+                elif features.left_wrist_up or features.right_wrist_up:
                     if last_command == '+':
-                        same_command_count += 1
+                        same_command_count += pose_step
                     elif last_command == '++':  # Do not unintentional trigger single +, if not lowering both arms exacly at the same time 
-                        same_command_count += 1
+                        same_command_count += pose_step
                     else:
                         last_command = '+'
                         if code.endswith('+++++'):
@@ -385,17 +483,17 @@ def main():
                         same_command_count = 0
 
                     if same_command_count > COMMAND_DELAY:
-                        if landmarks[PoseLandmark.RIGHT_WRIST][2] < landmarks[PoseLandmark.NOSE][2] - upper_arm: 
-                            draw_white_apha_box(frame, 145, 95, 110, 120)
-                            cv2.putText(frame, '+', (140, 200), cv2.FONT_HERSHEY_PLAIN, FONT_SIZE, (0,0,255), FONT_WEIGHT) 
-                        if landmarks[PoseLandmark.LEFT_WRIST][2] < landmarks[PoseLandmark.NOSE][2] - upper_arm:
-                            draw_white_apha_box(frame, 385, 95, 110, 120)
-                            cv2.putText(frame, '+', (380, 200), cv2.FONT_HERSHEY_PLAIN, FONT_SIZE, (0,0,255), FONT_WEIGHT)
+                        if features.right_wrist_up:
+                            draw_alpha_box(frame, 145, 95, 110, 120, 255, 0.5)
+                            GLYPH_ATLAS.draw(frame, '+', (140, 200), cv2.FONT_HERSHEY_PLAIN, FONT_SIZE, (0,0,255), FONT_WEIGHT) 
+                        if features.left_wrist_up:
+                            draw_alpha_box(frame, 385, 95, 110, 120, 255, 0.5)
+                            GLYPH_ATLAS.draw(frame, '+', (380, 200), cv2.FONT_HERSHEY_PLAIN, FONT_SIZE, (0,0,255), FONT_WEIGHT)
             
                 # Duck, shoulders below threshold
-                elif landmarks[PoseLandmark.LEFT_SHOULDER][2] > THRESHOLD_DUCK_Y and landmarks[PoseLandmark.RIGHT_SHOULDER][2] > THRESHOLD_DUCK_Y: 
+                elif landmarks[PoseLandmark.LEFT_SHOULDER, Y] > THRESHOLD_DUCK_Y and landmarks[PoseLandmark.RIGHT_SHOULDER, Y] > THRESHOLD_DUCK_Y: 
                     if last_command == '-':
-                        same_command_count += 1
+                        same_command_count += pose_step
                     else:
                         last_command = '-'
                         if code.endswith('-----'):
@@ -404,57 +502,54 @@ def main():
                             code += last_command
                         same_command_count = 0
                     if same_command_count > COMMAND_DELAY:
-                        draw_white_apha_box(frame, 260, 95, 110, 120)
-                        cv2.putText(frame, '-', (280-20, 200-5), cv2.FONT_HERSHEY_PLAIN, FONT_SIZE, (0,0,255), FONT_WEIGHT)   
+                        draw_alpha_box(frame, 260, 95, 110, 120, 255, 0.5)
+                        GLYPH_ATLAS.draw(frame, '-', (280-20, 200-5), cv2.FONT_HERSHEY_PLAIN, FONT_SIZE, (0,0,255), FONT_WEIGHT)   
                 
                 # Body to the left
-                elif landmarks[PoseLandmark.LEFT_SHOULDER][1] < THRESHOLD_LEFT_X and landmarks[PoseLandmark.RIGHT_SHOULDER][1] < THRESHOLD_LEFT_X:
+                elif landmarks[PoseLandmark.LEFT_SHOULDER, X] < THRESHOLD_LEFT_X and landmarks[PoseLandmark.RIGHT_SHOULDER, X] < THRESHOLD_LEFT_X:
                     if last_command == '<' or last_command == '[':
-                        same_command_count += 1
+                        same_command_count += pose_step
                     else:
                         last_command = '<'
                         same_command_count = 0
                     if same_command_count > COMMAND_DELAY and same_command_count < 30:
-                        draw_white_apha_box(frame, 260, 95, 110, 120)
-                        cv2.putText(frame, '<', (260+5, 200), cv2.FONT_HERSHEY_PLAIN, FONT_SIZE, (0,0,255), FONT_WEIGHT)   
+                        draw_alpha_box(frame, 260, 95, 110, 120, 255, 0.5)
+                        GLYPH_ATLAS.draw(frame, '<', (260+5, 200), cv2.FONT_HERSHEY_PLAIN, FONT_SIZE, (0,0,255), FONT_WEIGHT)   
                     if same_command_count > 30:
                         if last_command != '[':
                             last_command = '['
                             code += last_command
                             if execute_code == True and interpreter_stopped == False and interpreter_finished_debug_and_print == False:
                                 reload_code = True
-                        draw_white_apha_box(frame, 260, 95, 110, 120)
+                        draw_alpha_box(frame, 260, 95, 110, 120, 255, 0.5)
                         # [ is strangely large, print it a little smaller, and further up, than other commands
-                        cv2.putText(frame, '[', (280+20, 200-25), cv2.FONT_HERSHEY_PLAIN, FONT_SIZE - 5, (0,0,255), FONT_WEIGHT)   
+                        GLYPH_ATLAS.draw(frame, '[', (280+20, 200-25), cv2.FONT_HERSHEY_PLAIN, FONT_SIZE - 5, (0,0,255), FONT_WEIGHT)   
                 
                 # Body to the right
-                elif landmarks[PoseLandmark.LEFT_SHOULDER][1] > THRESHOLD_RIGHT_X and landmarks[PoseLandmark.RIGHT_SHOULDER][1] > THRESHOLD_RIGHT_X:
+                elif landmarks[PoseLandmark.LEFT_SHOULDER, X] > THRESHOLD_RIGHT_X and landmarks[PoseLandmark.RIGHT_SHOULDER, X] > THRESHOLD_RIGHT_X:
                     if last_command == '>' or last_command == ']':
-                        same_command_count += 1
+                        same_command_count += pose_step
                     else:
                         last_command = '>'
                         same_command_count = 0
                     if same_command_count > COMMAND_DELAY and same_command_count < 30:
-                        draw_white_apha_box(frame, 260, 95, 110, 120)
-                        cv2.putText(frame, '>', (260+5, 200), cv2.FONT_HERSHEY_PLAIN, FONT_SIZE, (0,0,255), FONT_WEIGHT)   
+                        draw_alpha_box(frame, 260, 95, 110, 120, 255, 0.5)
+                        GLYPH_ATLAS.draw(frame, '>', (260+5, 200), cv2.FONT_HERSHEY_PLAIN, FONT_SIZE, (0,0,255), FONT_WEIGHT)   
                     if same_command_count > 30:
                         if last_command != ']':
                             last_command = ']'
                             code += last_command
                             if execute_code == True and interpreter_stopped == False and interpreter_finished_debug_and_print == False:
                                 reload_code = True
-                        draw_white_apha_box(frame, 260, 95, 110, 120)
+                        draw_alpha_box(frame, 260, 95, 110, 120, 255, 0.5)
                         # ] is strangely large, print it a little smaller, and further up, than other commands
-                        cv2.putText(frame, ']', (280+20, 200-25), cv2.FONT_HERSHEY_PLAIN, FONT_SIZE - 5, (0,0,255), FONT_WEIGHT)   
+                        GLYPH_ATLAS.draw(frame, ']', (280+20, 200-25), cv2.FONT_HERSHEY_PLAIN, FONT_SIZE - 5, (0,0,255), FONT_WEIGHT)   
 
                 # Facepalm (right handed)
                 # Index finger horizontally between the outer eyes, above eyes, not too far above head
-                elif landmarks[PoseLandmark.LEFT_INDEX][1] < landmarks[PoseLandmark.LEFT_EYE_OUTER][1] \
-                        and landmarks[PoseLandmark.LEFT_INDEX][1] > landmarks[PoseLandmark.RIGHT_EYE_OUTER][1] \
-                        and landmarks[PoseLandmark.LEFT_INDEX][2] < landmarks[PoseLandmark.NOSE][2] \
-                        and landmarks[PoseLandmark.LEFT_INDEX][2] > landmarks[PoseLandmark.NOSE][2] - half_upper_arm:
+                elif features.facepalm:
                     if last_command == '⌫':
-                        same_command_count += 1
+                        same_command_count += pose_step
                     else:
                         last_command = '⌫'
                         same_command_count = 0
@@ -462,8 +557,8 @@ def main():
                             reload_code = True                    
                         code = code[:-1]
                     if same_command_count > COMMAND_DELAY:
-                        bubble_x = landmarks[PoseLandmark.MOUTH_RIGHT][1]
-                        bubble_y = landmarks[PoseLandmark.MOUTH_RIGHT][2]
+                        bubble_x = int(landmarks[PoseLandmark.MOUTH_RIGHT, X])
+                        bubble_y = int(landmarks[PoseLandmark.MOUTH_RIGHT, Y])
                         speech_bubble.draw(frame, bubble_x, bubble_y, half_upper_arm)
                 else:
                     if last_command in ['<','>']:
@@ -473,31 +568,29 @@ def main():
 
                     # Dummy command to identify default position with arms down
                     # Clapping should be performed while starting in this position. With wrists higher than elbows
-                    shoulder_r = detector.find_angle(PoseLandmark.LEFT_HIP, PoseLandmark.LEFT_SHOULDER, PoseLandmark.LEFT_ELBOW)
-                    shoulder_l = detector.find_angle(PoseLandmark.RIGHT_HIP, PoseLandmark.RIGHT_SHOULDER, PoseLandmark.RIGHT_ELBOW)
-                    if shoulder_r < 60 and shoulder_l < 60: # Arms facing downwards
+                    if features.shoulder_r < 60 and features.shoulder_l < 60: # Arms facing downwards
                         # Remember that right and left are mirrored, because the image is flipped
-                        if landmarks[PoseLandmark.LEFT_SHOULDER][1] < 500 and landmarks[PoseLandmark.RIGHT_SHOULDER][1] < 500: # not too far right
-                            if landmarks[PoseLandmark.LEFT_SHOULDER][1] > 140 and landmarks[PoseLandmark.RIGHT_SHOULDER][1] > 140: # not too far left
+                        if landmarks[PoseLandmark.LEFT_SHOULDER, X] < 500 and landmarks[PoseLandmark.RIGHT_SHOULDER, X] < 500: # not too far right
+                            if landmarks[PoseLandmark.LEFT_SHOULDER, X] > 140 and landmarks[PoseLandmark.RIGHT_SHOULDER, X] > 140: # not too far left
                                 last_command = 'default'
                                 print_lock = 0 # Must return to default between each print command
                                 
                     if clap_print1 == 1 or clap_print2 == 1:
                         if clap_display_for_frames > 0:
-                            clap_display_for_frames -= 1
+                            clap_display_for_frames -= pose_step
                             if clap_count >= 2:
-                                draw_white_apha_box(frame, 120, 95, 110, 400)
-                                cv2.putText(frame, 'Clap! Clap!', (150, 180), cv2.FONT_HERSHEY_PLAIN, 4, (0,0,255), FONT_WEIGHT)
+                                draw_alpha_box(frame, 120, 95, 110, 400, 255, 0.5)
+                                GLYPH_ATLAS.draw(frame, 'Clap! Clap!', (150, 180), cv2.FONT_HERSHEY_PLAIN, 4, (0,0,255), FONT_WEIGHT)
                             elif clap_count == 1:
-                                draw_white_apha_box(frame, 200-10, 95, 110, 220)
-                                cv2.putText(frame, 'Clap!', (225, 180), cv2.FONT_HERSHEY_PLAIN, 4, (0,0,255), FONT_WEIGHT)
+                                draw_alpha_box(frame, 200-10, 95, 110, 220, 255, 0.5)
+                                GLYPH_ATLAS.draw(frame, 'Clap!', (225, 180), cv2.FONT_HERSHEY_PLAIN, 4, (0,0,255), FONT_WEIGHT)
                         else:
                             if clap_count == 1:
                                 nova_end_time = datetime.datetime.now()
                                 if execute_code:
                                     if interpreter_finished_debug_and_print or interpreter_stopped:
-                                        interpreter.input_code(lines_of_code)
-                                        ok, (interpreter_error_line, interpreter_error_char) = interpreter.prepare_code()
+                                        interpreter_thread.input_code(lines_of_code, code_x)
+                                        ok, interpreter_error_pc = interpreter_thread.prepare_code()
                                         code_output = ''
                                         execute_code = True
                                         if not ok:
@@ -510,8 +603,8 @@ def main():
                                             interpreter_finished_debug_and_print = False
                                 else:
                                     if len(code) > 0:
-                                        interpreter.input_code(lines_of_code)
-                                        ok, (interpreter_error_line, interpreter_error_char) = interpreter.prepare_code()
+                                        interpreter_thread.input_code(lines_of_code, code_x)
+                                        ok, interpreter_error_pc = interpreter_thread.prepare_code()
                                         code_output = ''
                                         execute_code = True
                                         if not ok:
@@ -528,13 +621,13 @@ def main():
                             clap_count = 0
 
                     if last_command == 'default' or last_command == '':
-                        if landmarks[PoseLandmark.LEFT_INDEX][1] > landmarks[PoseLandmark.LEFT_SHOULDER][1] and landmarks[PoseLandmark.RIGHT_INDEX][1] < landmarks[PoseLandmark.RIGHT_SHOULDER][1]:
-                            if landmarks[PoseLandmark.LEFT_WRIST][2] < landmarks[PoseLandmark.LEFT_ELBOW][2] and landmarks[PoseLandmark.RIGHT_WRIST][2] < landmarks[PoseLandmark.RIGHT_ELBOW][2]:
-                                if landmarks[PoseLandmark.LEFT_SHOULDER][2] < landmarks[PoseLandmark.LEFT_ELBOW][2] and landmarks[PoseLandmark.RIGHT_SHOULDER][2] < landmarks[PoseLandmark.RIGHT_ELBOW][2]:
+                        if landmarks[PoseLandmark.LEFT_INDEX, X] > landmarks[PoseLandmark.LEFT_SHOULDER, X] and landmarks[PoseLandmark.RIGHT_INDEX, X] < landmarks[PoseLandmark.RIGHT_SHOULDER, X]:
+                            if landmarks[PoseLandmark.LEFT_WRIST, Y] < landmarks[PoseLandmark.LEFT_ELBOW, Y] and landmarks[PoseLandmark.RIGHT_WRIST, Y] < landmarks[PoseLandmark.RIGHT_ELBOW, Y]:
+                                if landmarks[PoseLandmark.LEFT_SHOULDER, Y] < landmarks[PoseLandmark.LEFT_ELBOW, Y] and landmarks[PoseLandmark.RIGHT_SHOULDER, Y] < landmarks[PoseLandmark.RIGHT_ELBOW, Y]:
                                     clap_stage = 'wide' 
                                     clap_closing_timeframe = 25    
-                        if clap_stage == 'wide' and clap_closing_timeframe > 0 and abs(landmarks[PoseLandmark.LEFT_INDEX][1] - landmarks[PoseLandmark.RIGHT_INDEX][1]) < int(half_upper_arm):
-                            if landmarks[PoseLandmark.LEFT_WRIST][2] < landmarks[PoseLandmark.LEFT_ELBOW][2] and landmarks[PoseLandmark.RIGHT_WRIST][2] < landmarks[PoseLandmark.RIGHT_ELBOW][2]:
+                        if clap_stage == 'wide' and clap_closing_timeframe > 0 and abs(landmarks[PoseLandmark.LEFT_INDEX, X] - landmarks[PoseLandmark.RIGHT_INDEX, X]) < int(half_upper_arm):
+                            if landmarks[PoseLandmark.LEFT_WRIST, Y] < landmarks[PoseLandmark.LEFT_ELBOW, Y] and landmarks[PoseLandmark.RIGHT_WRIST, Y] < landmarks[PoseLandmark.RIGHT_ELBOW, Y]:
                                 clap_stage = 'clap'
                                 clap_count += 1
                     if clap_count >= 2:
@@ -561,7 +654,7 @@ def main():
                                 else:
                                     interpreter_paused = True
                     elif clap_stage == 'wide' and clap_closing_timeframe > 0:
-                        clap_closing_timeframe -= 1
+                        clap_closing_timeframe -= pose_step
 
             if last_command not in ['default', '']:
                 nova_end_time = None
@@ -610,9 +703,33 @@ def main():
                 interpreter_paused = False
                 nova_end_time = None
                 # Make sure cells at the bottom of the screen is hidden
-                ok, (interpreter_error_line, interpreter_error_char) = interpreter.prepare_code()
+                ok, interpreter_error_pc = interpreter_thread.prepare_code()
             elif key == ord('p') or key == ord('P'): #Pause
                 pause = not pause
+            elif key == ord('f') or key == ord('F'): #Switch interpreter mode
+                interpreter_mode = MODES[(MODES.index(interpreter_mode) + 1) % len(MODES)]
+                interpreter_thread.send('mode', interpreter_mode)
+                print('Interpreter mode:', interpreter_mode)
+            elif key == ord('k') or key == ord('K'): #Toggle breakpoint
+                interpreter_thread.send('breakpoint', pc)
+            elif key == ord('h') or key == ord('H'): #Toggle tape heatmap
+                show_tape_heatmap = not show_tape_heatmap
+                interpreter_thread.send('tape_heatmap', show_tape_heatmap)
+            elif key == ord('t') or key == ord('T'): #Record a trace of every command executed
+                if tracing:
+                    trace_path = datetime.datetime.now().strftime('trace-%Y%m%d-%H%M%S.npy')
+                    interpreter_thread.send('stop_trace', trace_path)
+                    print('Trace saved to', trace_path)
+                else:
+                    interpreter_thread.send('start_trace')
+                    print('Recording trace')
+                tracing = not tracing
+            elif (key == ord('n') or key == ord('N')) and execute_code and interpreter_paused: #Jump to next output
+                interpreter_finished_debug_and_print = False
+                interpreter_thread.send('seek_output', len(code_output))
+            elif (key == ord('b') or key == ord('B')) and execute_code and interpreter_paused: #Jump back to previous output
+                interpreter_finished_debug_and_print = False
+                interpreter_thread.send('seek_output', len(code_output) - 2)
             elif key == 7995392: #F11
                 fullscreen = not fullscreen
                 if fullscreen:
@@ -648,7 +765,10 @@ def main():
             except Exception as e:
                 print("Error posting score:", e)   
 
-    cap.release()
+    interpreter_thread.stop()
+    capture_thread.stop()
+    print(f'{capture_thread.captured} frames captured, {capture_thread.dropped} dropped')
+    detector.close()
     cv2.destroyAllWindows()
 
 def on_mouse(event, x, y, flags, param):
@@ -0,0 +1,74 @@
+# Run brainfuck code without webcam, MediaPipe or any window, using the same interpreter as bodyfuck.py
+# The tape grows dynamically, < stops at the first cell and , (input) is ignored
+# The output is written to stdout, and the number of steps and time spent to stderr
+
+import argparse
+from collections import namedtuple
+from Interpreter import Visualnterpreter
+import sys
+import time
+
+RunResult = namedtuple('RunResult', ['output', 'steps', 'seconds', 'finished', 'error_pc', 'tape_length', 'stuck_loop'])
+
+# Steps between checking the time limit
+CHUNK_STEPS = 100000
+
+def run_program(source, max_steps = None, time_limit = None, trace_path = None):
+    interpreter = Visualnterpreter()
+    # Nobody travels back in time without a screen
+    interpreter.keep_history = False
+    interpreter.input_code(source.splitlines())
+    ok, error_pc = interpreter.prepare_code()
+    if not ok:
+        return RunResult('', 0, 0.0, False, error_pc, 0, None)
+    if trace_path is not None:
+        interpreter.start_trace()
+
+    start = time.perf_counter()
+    finished = len(interpreter.program) == 0
+    while not finished:
+        steps = CHUNK_STEPS if max_steps is None else min(CHUNK_STEPS, max_steps - interpreter.step_count)
+        if steps <= 0:
+            break
+        finished, _, _, _ = interpreter.run(steps)
+        if interpreter.stuck_loop is not None:
+            break
+        if time_limit is not None and time.perf_counter() - start > time_limit:
+            break
+    seconds = time.perf_counter() - start
+    if trace_path is not None:
+        interpreter.save_trace(trace_path)
+    return RunResult(''.join(interpreter.output), interpreter.step_count, seconds, finished, None, interpreter.tape_length, interpreter.stuck_loop)
+
+def main():
+    parser = argparse.ArgumentParser(description='Run brainfuck code headless, with the bodyfuck interpreter.')
+    parser.add_argument('file', nargs='?', help='brainfuck source file, reads stdin when left out')
+    parser.add_argument('--max-steps', type=int, help='stop after this many steps')
+    parser.add_argument('--time-limit', type=float, help='stop after this many seconds')
+    parser.add_argument('--trace', help='record every command executed to this .npy file')
+    args = parser.parse_args()
+
+    if args.file is None or args.file == '-':
+        source = sys.stdin.read()
+    else:
+        with open(args.file, 'r') as f:
+            source = f.read()
+
+    result = run_program(source, args.max_steps, args.time_limit, args.trace)
+    if result.error_pc is not None:
+        print(f'Unbalanced loop at command {result.error_pc}', file=sys.stderr)
+        sys.exit(1)
+
+    sys.stdout.write(result.output)
+    sys.stdout.flush()
+    steps_per_second = result.steps / result.seconds if result.seconds > 0 else 0
+    print(f'\n{result.steps} steps in {result.seconds:.3f} s ({steps_per_second:,.0f} steps/s)', file=sys.stderr)
+    if result.stuck_loop is not None:
+        print(f'Endless loop from command {result.stuck_loop[0]} to {result.stuck_loop[1]}', file=sys.stderr)
+        sys.exit(2)
+    if not result.finished:
+        print('Stopped before the end of the program', file=sys.stderr)
+        sys.exit(2)
+
+if __name__ == "__main__":
+    main()